@@ -0,0 +1,33 @@
+import pytest
+
+
+class Timers(object):
+    """call_later that keeps the calls, so a test decides when the delay expires."""
+    def __init__(self):
+        self.calls = []
+#
+    def call_later(self, delay, function, *args):
+        timer = Timer(function, args)
+        self.calls.append(timer)
+        return timer
+#
+    def expire(self):
+        for timer in self.calls:
+            if not timer.cancelled:
+                timer.function(*timer.args)
+        self.calls = []
+
+
+class Timer(object):
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.cancelled = False
+#
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def timers():
+    return Timers()
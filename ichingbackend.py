@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+# Display and input backends for the I Ching Hexagrams program.
+#
+# load_backend("pifacecad") gives the real PiFaceCAD board, switches and LIRC remote.
+# load_backend("simulator") gives an in-memory LCD and listeners that run anywhere, so the
+# menus can be driven from a script and the cost of drawing them measured off the Pi.
+#
+# Both provide the same names: PiFaceCAD, SwitchEventListener, IREventListener, IODIR_ON,
+# LCDBitmap, IRInitError and LCD_WIDTH.  IREventListener takes the board as chip, like
+# SwitchEventListener: LIRC serves the whole Pi so the real one ignores it, but each
+# simulated board has its own remote.
+#
+
+import threading
+from collections import Counter, namedtuple
+from time import sleep
+
+Backend = namedtuple('Backend', ['name', 'PiFaceCAD', 'SwitchEventListener', 'IREventListener',
+                                 'IODIR_ON', 'LCDBitmap', 'IRInitError', 'LCD_WIDTH'])
+
+SIM_WIDTH = 16              # Visible characters per row
+SIM_ROWS = 2
+DDRAM_WIDTH = 40            # HD44780 display RAM per row, the visible window can be shifted along it
+CGRAM_SLOTS = 8
+
+#
+#   Bus timing model, in seconds: each command or data byte goes over SPI as two nibbles
+#   through the MCP23S17 port expander, clear and home also keep the controller busy.
+#
+
+BYTE_TIME = 0.000080
+CLEAR_TIME = 0.00164
+
+
+def load_backend(name="pifacecad"):
+    if name == "pifacecad":
+        import pifacecad                        # Only needed on the Raspberry Pi
+        import lirc
+        from pifacecad.lcd import LCD_WIDTH
+        def ir_listener(prog, lircrc=None, chip=None):
+            return pifacecad.IREventListener(prog=prog, lircrc=lircrc)
+        return Backend("pifacecad", pifacecad.PiFaceCAD, pifacecad.SwitchEventListener,
+                       ir_listener, pifacecad.IODIR_ON, pifacecad.LCDBitmap,
+                       lirc.InitError, LCD_WIDTH)
+    if name == "simulator":
+        return Backend("simulator", SimulatedCAD, SimulatedSwitchListener, SimulatedIRListener,
+                       SIM_IODIR_ON, bytes, SimulatedIRError, SIM_WIDTH)
+    raise ValueError("Unknown backend {!r}, use 'pifacecad' or 'simulator'".format(name))
+
+
+class SimulatedLCD(object):
+    """In-memory HD44780 with the calls pifacecad.lcd provides, counting bus writes and time."""
+    def __init__(self, realtime=False):
+        self.realtime = realtime                # Sleep for the modelled bus time of each call
+        self.ddram = [[' '] * DDRAM_WIDTH for row in range(SIM_ROWS)]
+        self.cgram = [bytes(8)] * CGRAM_SLOTS
+        self.column = self.row = 0
+        self.offset = 0                         # Display shift, first DDRAM column on view
+        self.addressing_cgram = False
+        self.backlight = self.display = False
+        self.bus_writes = 0
+        self.bus_time = 0.0
+        self.calls = Counter()
+#
+    def bus(self, name, writes, busy=0.0):
+        self.calls[name] += 1
+        self.bus_writes += writes
+        elapsed = writes * BYTE_TIME + busy
+        self.bus_time += elapsed
+        if self.realtime:
+            sleep(elapsed)
+#
+    def put(self, char):
+        if self.addressing_cgram:
+            raise RuntimeError("LCD written after store_custom_bitmap without a set_cursor")
+        self.ddram[self.row][self.column] = char
+        self.column += 1
+        if self.column == DDRAM_WIDTH:
+            self.column = 0
+            self.row = (self.row + 1) % SIM_ROWS
+#
+    def write(self, text):
+        for char in text:
+            self.put(char)
+        self.bus('write', len(text))
+#
+    def write_custom_bitmap(self, index):
+        self.put(chr(index))
+        self.bus('write_custom_bitmap', 1)
+#
+    def store_custom_bitmap(self, index, bitmap):
+        self.cgram[index] = bytes(bitmap)
+        self.addressing_cgram = True
+        self.bus('store_custom_bitmap', 1 + len(bitmap))
+#
+    def set_cursor(self, column, row):
+        self.column, self.row = column, row
+        self.addressing_cgram = False
+        self.bus('set_cursor', 1)
+#
+    def clear(self):
+        self.ddram = [[' '] * DDRAM_WIDTH for row in range(SIM_ROWS)]
+        self.column = self.row = self.offset = 0
+        self.addressing_cgram = False
+        self.bus('clear', 1, CLEAR_TIME)
+#
+    def home(self):
+        self.column = self.row = self.offset = 0
+        self.addressing_cgram = False
+        self.bus('home', 1, CLEAR_TIME)
+#
+    def move_left(self):                        # Text moves left, so the window moves right
+        self.offset = (self.offset + 1) % DDRAM_WIDTH
+        self.bus('move_left', 1)
+#
+    def move_right(self):
+        self.offset = (self.offset - 1) % DDRAM_WIDTH
+        self.bus('move_right', 1)
+#
+    def switch(self, name, attribute, value):
+        setattr(self, attribute, value)
+        self.bus(name, 1)
+#
+    def backlight_on(self):
+        self.backlight = True
+        self.calls['backlight_on'] += 1         # Backlight is a port pin, not an LCD command
+#
+    def backlight_off(self):
+        self.backlight = False
+        self.calls['backlight_off'] += 1
+#
+    def display_on(self):
+        self.switch('display_on', 'display', True)
+#
+    def display_off(self):
+        self.switch('display_off', 'display', False)
+#
+    def blink_on(self):
+        self.bus('blink_on', 1)
+#
+    def blink_off(self):
+        self.bus('blink_off', 1)
+#
+    def cursor_on(self):
+        self.bus('cursor_on', 1)
+#
+    def cursor_off(self):
+        self.bus('cursor_off', 1)
+#
+    def screen(self):
+        """The two visible rows as strings, custom bitmaps appear as '\\x00' to '\\x07'."""
+        return ["".join(self.ddram[row][(self.offset + column) % DDRAM_WIDTH]
+                        for column in range(SIM_WIDTH)) for row in range(SIM_ROWS)]
+#
+    def stats(self):
+        return "LCD bus writes {}, modelled bus time {:.1f} ms".format(self.bus_writes, self.bus_time * 1000)
+
+
+SIM_IODIR_ON = 0
+
+SwitchEvent = namedtuple('SwitchEvent', ['pin_num', 'direction', 'chip'])
+IREvent = namedtuple('IREvent', ['ir_code'])
+
+
+class SimulatedIRError(Exception):
+    """Stands in for lirc.InitError, the simulated remote always starts."""
+
+
+class SimulatedCAD(object):
+    """In-memory PiFaceCAD: an LCD plus the listeners registered against it."""
+    def __init__(self, realtime=False):
+        self.lcd = SimulatedLCD(realtime)
+        self.switch_listeners = []
+        self.ir_listeners = []                  # Active listeners of this board's remote
+#
+    def press(self, pin):
+        """Press switch pin, running the callbacks of every active listener."""
+        for listener in self.switch_listeners:
+            listener.dispatch(SwitchEvent(pin, SIM_IODIR_ON, self))
+#
+    def press_ir(self, code):
+        """Send a remote control code to the active IR listeners of this board."""
+        for listener in list(self.ir_listeners):
+            listener.dispatch(IREvent(str(code)))
+#
+    def play(self, script):
+        """Replay script on a background thread: (delay, 'switch' or 'ir', code) tuples."""
+        def run():
+            for delay, source, code in script:
+                sleep(delay)
+                if source == 'ir':
+                    self.press_ir(code)
+                else:
+                    self.press(code)
+        player = threading.Thread(target=run, name="ScriptedInput", daemon=True)
+        player.start()
+        return player
+
+
+class SimulatedSwitchListener(object):
+    def __init__(self, chip=None):
+        self.chip = chip
+        self.callbacks = []
+        self.active = False
+        if chip is not None:
+            chip.switch_listeners.append(self)
+#
+    def register(self, pin_num, direction, callback):
+        self.callbacks.append((pin_num, direction, callback))
+#
+    def activate(self):
+        self.active = True
+#
+    def deactivate(self):
+        self.active = False
+#
+    def dispatch(self, event):
+        if self.active:
+            for pin_num, direction, callback in self.callbacks:
+                if pin_num == event.pin_num and direction == event.direction:
+                    callback(event)
+
+
+class SimulatedIRListener(object):
+    def __init__(self, prog=None, lircrc=None, chip=None):
+        self.prog = prog
+        self.chip = chip
+        self.callbacks = []
+        self.active = False
+#
+    def register(self, ir_code, callback):
+        self.callbacks.append((ir_code, callback))
+#
+    def activate(self):
+        self.active = True
+        if self.chip is not None and self not in self.chip.ir_listeners:
+            self.chip.ir_listeners.append(self)
+#
+    def deactivate(self):                       # The board lets go of it, so a closed session is not kept
+        self.active = False
+        if self.chip is not None and self in self.chip.ir_listeners:
+            self.chip.ir_listeners.remove(self)
+#
+    def dispatch(self, event):
+        if self.active:
+            for ir_code, callback in self.callbacks:
+                if ir_code == event.ir_code:
+                    callback(event)
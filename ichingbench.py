@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# Benchmarks for the I Ching Hexagrams hot paths, run headless on the simulator backend.
+#
+#   python3 ichingbench.py                      - run and print the results
+#   python3 ichingbench.py --save FILE          - also save them as a JSON baseline
+#   python3 ichingbench.py --compare FILE       - exit 1 if anything regressed against FILE
+#   python3 ichingbench.py --tolerance 0.5      - allowed wall time growth when comparing
+#
+# Each benchmark reports wall time per operation (best of REPEATS), LCD bus writes per
+# operation and the peak memory allocated while running it.  The LCD writer runs on the
+# calling thread, so the bus write counts are exact and repeatable.
+#
+
+import json
+import os
+import sys
+import tracemalloc
+from itertools import count as counter
+from time import perf_counter
+
+os.environ.setdefault("ICHING_BACKEND", "simulator")
+
+import ichingmenus
+import ichinghexagrams
+from ichingcast import Caster, cast_batch, make_generator
+from ichinghexagrams import Casting, have_numpy
+
+REPEATS = 5
+TIME_TOLERANCE = 0.30           # Wall time may grow by 30% before it counts as a regression
+ALLOC_TOLERANCE = 0.10          # Peak allocation may grow by 10%
+WRITES_TOLERANCE = 0.0          # Bus writes are exact, any increase is a regression
+PRESS_GAP = 1.0                 # Seconds between simulated button presses
+
+
+def start_session():
+    """A Session on a simulated board, at the top level menu."""
+    clock = counter(0.0, PRESS_GAP).__next__     # Presses a second apart are never bounce or repeats
+    session = ichingmenus.Session(ichingmenus.backend.PiFaceCAD(), threaded=False, clock=clock)
+    ichingmenus.fill_screens(session.display_lcd.screens)
+    ichingmenus.register_listeners(session)
+    session.display_lcd.splash = False
+    session.menus.waiting = False
+    session.menus.active = True
+    session.menus.begin_menu()
+    return session
+
+
+def press(session, pins):
+    for pin in pins:
+        session.cad.press(pin)
+        ichingmenus.run_pending(session)
+
+
+def bench_navigate(count):                      # Next / Previous through the active menu
+    session = start_session()
+    return session.cad, lambda: press(session, (7, 7, 7, 6)), 4
+
+
+def bench_navigate_burst(count):                # Three Next presses drawn as one screen
+    session = start_session()
+    def run():
+        for pin in (7, 7, 7):
+            session.cad.press(pin)
+        ichingmenus.run_pending(session)
+    return session.cad, run, 3
+
+
+def bench_select(count):                        # Select Cast, then Back to the main menu
+    session = start_session()
+    return session.cad, lambda: press(session, (0, 5, 4)), 3
+
+
+def bench_display_lines(count):                 # Hexagram screen, alternating two glyphs
+    session = start_session()
+    hexagrams = session.hexagrams
+    castings = [Casting.from_values((7, 9, 8, 9, 8, 8)), Casting.from_values((8, 8, 7, 6, 7, 9))]
+    def run():
+        for casting in castings:
+            hexagrams.casting = casting
+            hexagrams.display_lines
+    return session.cad, run, 2
+
+
+def bench_transform(count):
+    hexagrams = ichingmenus.Hexagrams(None)
+    casting = hexagrams.casting
+    def run():
+        hexagrams.casting = casting
+        hexagrams.transform()
+    return None, run, 1
+
+
+def bench_lookup(count):                        # Every line mask to its Hexagram
+    lookup = ichinghexagrams.lookup
+    def run():
+        for mask in range(ichinghexagrams.HEXAGRAM_COUNT):
+            lookup(mask)
+    return None, run, ichinghexagrams.HEXAGRAM_COUNT
+
+
+def bench_cast(count):
+    caster = Caster(1)
+    return None, lambda: caster.cast("Stalks"), 1
+
+
+def bench_cast_batch(count):
+    generator = make_generator(1)
+    batch = 100000
+    return None, lambda: cast_batch("Stalks", batch, generator), batch
+
+
+BENCHMARKS = [
+    ("navigate", bench_navigate, 2000),
+    ("navigate_burst", bench_navigate_burst, 2000),
+    ("select", bench_select, 2000),
+    ("display_lines", bench_display_lines, 2000),
+    ("transform", bench_transform, 500000),
+    ("lookup", bench_lookup, 20000),
+    ("cast", bench_cast, 50000),
+    ("cast_batch", bench_cast_batch, 20),
+]
+
+
+def measure(setup, count):
+    best = None
+    writes = 0
+    for repeat in range(REPEATS):
+        cad, run, ops = setup(count)
+        before = cad.lcd.bus_writes if cad else 0
+        start = perf_counter()
+        for index in range(count):
+            run()
+        elapsed = perf_counter() - start
+        writes = (cad.lcd.bus_writes - before) if cad else 0
+        best = elapsed if best is None else min(best, elapsed)
+    cad, run, ops = setup(count)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for index in range(min(count, 100)):
+        run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'ops': count * ops,
+        'us_per_op': best / (count * ops) * 1e6,
+        'bus_writes_per_op': writes / (count * ops),
+        'alloc_peak_bytes': peak,
+    }
+
+
+def run_benchmarks():
+    results = {}
+    for name, setup, count in BENCHMARKS:
+        if name == "cast_batch" and not have_numpy():
+            continue                            # Batched casting needs NumPy
+        results[name] = measure(setup, count)
+        print("{:14} {:10.3f} us/op {:8.2f} bus writes/op {:10,} bytes peak".format(
+            name, results[name]['us_per_op'], results[name]['bus_writes_per_op'],
+            results[name]['alloc_peak_bytes']))
+    return results
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE):
+    """Return the regressions of results against baseline, as printable strings."""
+    limits = (('us_per_op', time_tolerance), ('alloc_peak_bytes', ALLOC_TOLERANCE),
+              ('bus_writes_per_op', WRITES_TOLERANCE))
+    regressions = []
+    for name, old in baseline.items():
+        if name not in results:
+            continue
+        for metric, tolerance in limits:
+            if results[name][metric] > old[metric] * (1 + tolerance) + 1e-9:
+                regressions.append("{} {} {:.3f} -> {:.3f}".format(
+                    name, metric, old[metric], results[name][metric]))
+    return regressions
+
+
+def option(name):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+        sys.exit("{} needs a value".format(name))
+    return None
+
+
+if __name__ == "__main__":
+    save_file = option("--save")
+    compare_file = option("--compare")
+    tolerance = float(option("--tolerance") or TIME_TOLERANCE)
+    results = run_benchmarks()
+    if save_file:
+        with open(save_file, "w") as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+        print("Saved baseline to " + save_file)
+    if compare_file:
+        with open(compare_file) as baseline:
+            regressions = compare(results, json.load(baseline), tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        print("{} regressions against {}".format(len(regressions), compare_file))
+        sys.exit(1 if regressions else 0)
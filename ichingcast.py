@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Casting engine for the CAST_MENU methods.
+#
+# Stalks  - yarrow stalks: 6, 7, 8, 9 with odds 1, 5, 7, 3 in 16.
+# Coins   - three coins, heads 3 and tails 2: 6, 7, 8, 9 with odds 1, 3, 3, 1 in 8.
+# Dice    - two eight sided dice pick the lower and upper trigrams and a six sided die
+#           picks the single moving line, so every casting has exactly one moving line.
+#
+# Caster.cast() makes one casting for the device.  cast_batch() makes NumPy arrays of
+# yang and moving masks for offline simulations, from a seedable NumPy generator.
+#
+#   python3 ichingcast.py check             - compare the tables with the stated odds
+#   python3 ichingcast.py benchmark [count] - per call against batched throughput
+#
+
+import random
+import sys
+from fractions import Fraction
+from time import perf_counter
+
+from ichinghexagrams import Casting, HEXAGRAM_COUNT, LINE_COUNT, have_numpy, need_numpy
+
+CAST_METHODS = ("Stalks", "Coins", "Dice")      # "User" castings are entered, not cast
+
+#
+#   Equally likely outcomes for one line.  Each table has a power of two entries so a
+#   line is a few random bits.
+#
+
+LINE_OUTCOMES = {
+    "Stalks": (6, 7, 7, 7, 7, 7, 8, 8, 8, 8, 8, 8, 8, 9, 9, 9),
+    "Coins": tuple(6 + bin(coins).count("1") for coins in range(8)),   # One bit per coin
+}
+DICE_MOVING_SIDES = LINE_COUNT
+
+
+def line_probabilities(method):
+    """Exact chance of each line value, {value: Fraction}, for one line of method."""
+    if method == "Dice":                        # Yang is an even chance, moving is 1 line in 6
+        still = Fraction(1, 2) * Fraction(DICE_MOVING_SIDES - 1, DICE_MOVING_SIDES)
+        moving = Fraction(1, 2) * Fraction(1, DICE_MOVING_SIDES)
+        return {6: moving, 7: still, 8: still, 9: moving}
+    outcomes = LINE_OUTCOMES[method]
+    return dict((value, Fraction(outcomes.count(value), len(outcomes))) for value in (6, 7, 8, 9))
+
+
+class Caster(object):
+    """Casts single hexagrams for the device from a seedable random generator."""
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+#
+    def cast(self, method="Stalks"):
+        if method == "Dice":
+            lower = self.random.getrandbits(3)
+            upper = self.random.getrandbits(3)
+            return Casting(upper << 3 | lower, 1 << self.random.randrange(DICE_MOVING_SIDES))
+        if method not in LINE_OUTCOMES:
+            raise ValueError("{!r} is not a casting method".format(method))
+        outcomes = LINE_OUTCOMES[method]
+        bits = len(outcomes).bit_length() - 1
+        return Casting.from_values([outcomes[self.random.getrandbits(bits)] for line in range(LINE_COUNT)])
+
+
+def make_generator(seed=None):
+    """NumPy random generator for cast_batch()."""
+    return need_numpy().random.default_rng(seed)
+
+
+def line_tables(method):
+    """Per line lookup tables from an outcome index to that line's yang and moving bits."""
+    np = need_numpy()
+    values = np.asarray(LINE_OUTCOMES[method], dtype=np.uint8)
+    yang = (values & 1).astype(np.uint8)
+    moving = ((values == 6) | (values == 9)).astype(np.uint8)
+    return ([(yang << line).astype(np.uint8) for line in range(LINE_COUNT)],
+            [(moving << line).astype(np.uint8) for line in range(LINE_COUNT)])
+
+
+def cast_batch(method, count, generator=None):
+    """Cast count hexagrams at once, returns (yang, moving) uint8 mask arrays."""
+    np = need_numpy()
+    if generator is None:
+        generator = make_generator()
+    if method == "Dice":
+        yang = generator.integers(0, HEXAGRAM_COUNT, size=count, dtype=np.uint8)
+        lines = generator.integers(0, DICE_MOVING_SIDES, size=count, dtype=np.uint8)
+        return yang, np.left_shift(1, lines, dtype=np.uint8)
+    if method not in LINE_OUTCOMES:
+        raise ValueError("{!r} is not a casting method".format(method))
+    bits = len(LINE_OUTCOMES[method]).bit_length() - 1
+    yang_tables, moving_tables = line_tables(method)
+    draws = generator.integers(0, 1 << bits * LINE_COUNT, size=count, dtype=np.uint32)
+    yang = np.zeros(count, dtype=np.uint8)
+    moving = np.zeros(count, dtype=np.uint8)
+    for line in range(LINE_COUNT):              # Each line is the next few bits of one draw
+        outcome = draws >> bits * line & (1 << bits) - 1
+        yang |= yang_tables[line][outcome]
+        moving |= moving_tables[line][outcome]
+    return yang, moving
+
+
+def check():
+    """Compare the outcome tables with the odds quoted above, returns a list of problems."""
+    expected = {
+        "Stalks": {6: Fraction(1, 16), 7: Fraction(5, 16), 8: Fraction(7, 16), 9: Fraction(3, 16)},
+        "Coins": {6: Fraction(1, 8), 7: Fraction(3, 8), 8: Fraction(3, 8), 9: Fraction(1, 8)},
+        "Dice": {6: Fraction(1, 12), 7: Fraction(5, 12), 8: Fraction(5, 12), 9: Fraction(1, 12)},
+    }
+    return ["{} line odds are {}".format(method, line_probabilities(method))
+            for method in CAST_METHODS if line_probabilities(method) != expected[method]]
+
+
+def benchmark(count):
+    caster = Caster(1)
+    for method in CAST_METHODS:
+        calls = max(count // 100, 1000)
+        start = perf_counter()
+        for index in range(calls):
+            caster.cast(method)
+        per_call = calls / (perf_counter() - start)
+        line = "{:7} per call {:12,.0f} castings/s".format(method, per_call)
+        if have_numpy():
+            generator = make_generator(1)
+            start = perf_counter()
+            cast_batch(method, count, generator)
+            batched = count / (perf_counter() - start)
+            line += "   batched {:14,.0f} castings/s  ({:.0f}x)".format(batched, batched / per_call)
+        print(line)
+
+
+if __name__ == "__main__":
+    if "check" in sys.argv:
+        problems = check()
+        for problem in problems:
+            print(problem)
+        print("{} problems in {} casting methods".format(len(problems), len(CAST_METHODS)))
+        sys.exit(1 if problems else 0)
+    elif "benchmark" in sys.argv:
+        counts = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+        benchmark(counts[0] if counts else 1000000)
+    else:
+        print("usage: ichingcast.py check|benchmark [count]")
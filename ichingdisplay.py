@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+#
+# Display helpers for the I Ching Hexagrams PiFaceCAD program.
+#
+# The HD44780 controller behind the PiFaceCAD LCD is driven one byte at a time over the
+# SPI port expander, so every character, cursor move and clear costs a bus transaction.
+# The classes here keep a copy of what is on the glass and only send what has changed.
+#
+
+import threading
+from collections import OrderedDict, deque
+from time import perf_counter
+
+from ichingtrace import traced
+
+# Relative cost, in bus writes, of each LCD call.  One command or data byte = one write.
+
+CURSOR_COST = 1             # set_cursor() is a single Set DDRAM Address command
+CLEAR_COST = 1              # clear() is a single command (but a slow one on the controller)
+CLEAR_BUSY = 21             # Writes the bus could send in the 1.64 ms the controller is busy clearing
+HOME_COST = 1               # home() also cancels any display shift
+GLYPH_CODES = 8             # Character codes 0-7 display the custom bitmaps held in CGRAM
+DDRAM_WIDTH = 40            # Display RAM per row, the visible window can be shifted along it
+
+SUPERSEDED = ('render', 'move_left', 'move_right', 'render_page', 'scroll')  # Queued commands a newer frame makes pointless
+
+
+class GlyphCache(object):
+    """Shares the 8 CGRAM slots between custom bitmaps, least recently used out first.
+
+    Bitmaps are keyed on their contents, so a glyph that is already resident is
+    reused without being uploaded again.
+    """
+    def __init__(self, frame, slots=GLYPH_CODES):
+        self.frame = frame
+        self.resident = OrderedDict()           # bitmap contents -> slot, least recently used first
+        self.free = list(range(slots))
+        self.uploads = 0
+        self.hits = 0
+#
+    def reserve(self, bitmaps, visible=()):
+        """Make every bitmap resident together and return {contents: slot}.
+
+        Slots used by this frame are never evicted for each other, and slots showing
+        on the current screen (visible) are only reused when nothing else is free.
+        """
+        wanted = OrderedDict((bytes(bitmap), bitmap) for bitmap in bitmaps)
+        pinned = set(self.resident[key] for key in wanted if key in self.resident)
+        slots = {}
+        for key, bitmap in wanted.items():
+            if key in self.resident:
+                self.resident.move_to_end(key)
+                self.hits += 1
+            else:
+                self.upload(key, bitmap, self.victim(pinned, visible))
+                pinned.add(self.resident[key])
+            slots[key] = self.resident[key]
+        return slots
+#
+    def victim(self, pinned, visible):
+        if self.free:
+            return self.free.pop(0)
+        spare = [key for key, slot in self.resident.items() if slot not in pinned]
+        if not spare:
+            raise ValueError("A frame can use at most {} custom bitmaps".format(len(self.resident)))
+        hidden = [key for key in spare if self.resident[key] not in visible]
+        return self.resident.pop((hidden or spare)[0])
+#
+    def upload(self, key, bitmap, slot):
+        self.frame.store_custom_bitmap(slot, bitmap)
+        self.resident[key] = slot
+        self.uploads += 1
+
+
+class FrameBuffer(object):
+    """Shadow copy of the LCD that turns whole frames into the fewest bus writes."""
+    def __init__(self, lcd, width=16, rows=2):
+        self.lcd = lcd
+        self.width = width
+        self.rows = rows
+        self.cells = [[None] * width for row in range(rows)]   # None = contents unknown
+        self.cursor = None                      # Controller cursor position, None if unknown
+        self.shift = 0                          # Net hardware display shift from move_left/right
+        self.used = DDRAM_WIDTH                 # Columns of display RAM that may hold text
+        self.page = None                        # Rows of the render_page() now on view, for scroll()
+        self.bus_writes = 0                     # Writes actually sent to the controller
+        self.naive_writes = 0                   # Writes a clear() and full rewrite would have cost
+        self.frames = 0
+        self.glyphs = GlyphCache(self)          # CGRAM slots for custom bitmaps in frames
+#
+    def invalidate(self):
+        """Forget the shadow copy after something else has written to the LCD."""
+        self.cells = [[None] * self.width for row in range(self.rows)]
+        self.cursor = None
+        self.used = DDRAM_WIDTH
+        self.page = None
+#
+    def clear(self):
+        self.lcd.clear()
+        self.bus_writes += CLEAR_COST
+        self.cells = [[' '] * self.width for row in range(self.rows)]
+        self.cursor = (0, 0)
+        self.shift = 0
+        self.used = 0
+        self.page = None
+#
+    def store_custom_bitmap(self, index, bitmap):
+        """Upload a custom bitmap, this leaves the controller addressing CGRAM."""
+        self.lcd.store_custom_bitmap(index, bitmap)
+        self.bus_writes += 1 + len(bitmap)
+        self.cursor = None                      # Next write must set a DDRAM address again
+#
+    def move_left(self):
+        self.lcd.move_left()
+        self.bus_writes += 1
+        self.shift -= 1
+#
+    def move_right(self):
+        self.lcd.move_right()
+        self.bus_writes += 1
+        self.shift += 1
+#
+    @traced("frame.render")
+    def render(self, lines):
+        """Bring the LCD up to date with lines, one entry per row.
+
+        A row is a string, or a list of strings and custom bitmaps.  Bitmaps are given
+        CGRAM slots by the glyph cache, and characters '\\x00' to '\\x07' are written
+        as the matching custom bitmap.  Rows are padded or cut to the display width.
+        """
+        self.frames += 1
+        self.page = None
+        lines = self.resolve_glyphs(lines)
+        texts = [(lines[row] if row < len(lines) else "")[:self.width].ljust(self.width)
+                 for row in range(self.rows)]
+        blank = [' '] * self.width
+        if self.cost(texts, [blank] * self.rows) + CLEAR_COST + CLEAR_BUSY < self.cost(texts, self.cells):
+            self.clear()                        # Mostly new screen, blanking it first is cheaper
+        elif self.shift:                          # Scrolled by an animation, so put it back first
+            self.home()
+        self.naive_writes += CLEAR_COST
+        for row, text in enumerate(texts):
+            self.naive_writes += CURSOR_COST + len(text.rstrip())
+            for start, end in self.changed_runs(self.cells[row], text):
+                if self.cursor != (start, row):
+                    self.lcd.set_cursor(start, row)
+                    self.bus_writes += CURSOR_COST
+                self.write_run(text[start:end])
+                self.cells[row][start:end] = list(text[start:end])
+                self.cursor = (end, row)
+#
+    def home(self):
+        self.lcd.home()
+        self.bus_writes += HOME_COST
+        self.cursor = (0, 0)
+        self.shift = 0
+#
+    @traced("frame.render_page")
+    def render_page(self, rows):
+        """Write rows of up to DDRAM_WIDTH characters, scroll(rows) brings the rest into view.
+
+        The display shift is cancelled first, so each page starts at its left hand end.
+        Columns left over from a longer page are blanked.
+        """
+        self.frames += 1
+        if self.shift:
+            self.home()
+        length = min(max([self.used] + [len(row) for row in rows]), DDRAM_WIDTH)
+        for row in range(self.rows):
+            text = (rows[row] if row < len(rows) else "")[:DDRAM_WIDTH].ljust(length)
+            self.naive_writes += CURSOR_COST + len(text)
+            self.lcd.set_cursor(0, row)
+            self.bus_writes += CURSOR_COST
+            self.write_run(text)
+            self.cells[row] = list(text[:self.width].ljust(self.width))
+        self.cursor = None                      # Writing past the last column wraps the address
+        self.used = max(len(row) for row in rows) if rows else 0
+        self.page = rows
+#
+    @traced("frame.scroll")
+    def scroll(self, rows):
+        """Move the text one column left, if the page written from rows is still on view."""
+        if self.page is rows:
+            self.move_left()
+#
+    def resolve_glyphs(self, lines):
+        bitmaps = [part for line in lines if not isinstance(line, str)
+                   for part in line if not isinstance(part, str)]
+        if not bitmaps:
+            return lines
+        visible = set(ord(cell) for row in self.cells for cell in row
+                      if cell is not None and ord(cell) < GLYPH_CODES)
+        slots = self.glyphs.reserve(bitmaps, visible)
+        return [line if isinstance(line, str) else
+                "".join(part if isinstance(part, str) else chr(slots[bytes(part)]) for part in line)
+                for line in lines]
+#
+    def cost(self, texts, shadow):
+        """Bus writes needed to turn shadow into texts, allowing a cursor move per run."""
+        return sum(CURSOR_COST + end - start
+                   for row, text in enumerate(texts)
+                   for start, end in self.changed_runs(shadow[row], text))
+#
+    def changed_runs(self, shadow, text):
+        """Return (start, end) spans of the shadow row that differ from text.
+
+        Spans separated by a single unchanged cell are merged, as rewriting that
+        cell costs the same as the cursor move needed to skip it.
+        """
+        runs = []
+        for col in range(self.width):
+            if shadow[col] == text[col]:
+                continue
+            if runs and col - runs[-1][1] <= CURSOR_COST:
+                runs[-1][1] = col + 1
+            else:
+                runs.append([col, col + 1])
+        return runs
+#
+    def write_run(self, text):
+        plain = ""
+        for char in text:
+            if ord(char) < GLYPH_CODES:
+                if plain:
+                    self.lcd.write(plain)
+                    plain = ""
+                self.lcd.write_custom_bitmap(ord(char))
+            else:
+                plain += char
+        if plain:
+            self.lcd.write(plain)
+        self.bus_writes += len(text)
+#
+    def stats(self):
+        return "Frames {}, bus writes {} (clear and rewrite would be {}), glyph uploads {}, reused {}".format(
+            self.frames, self.bus_writes, self.naive_writes, self.glyphs.uploads, self.glyphs.hits)
+
+
+class FrameCache(object):
+    """Finished screens by key, cut and padded to the display width with their bitmaps built.
+
+    Redrawing a cached screen is a dictionary lookup and a FrameBuffer diff.  Keys are
+    tuples of the kind of screen and everything it is built from (a casting's masks, a
+    menu item's position, a setting's value), so a cached screen never goes stale and
+    sessions sharing the cache each find their own screens.
+    """
+    def __init__(self, width=16):
+        self.width = width
+        self.frames = {}
+        self.hits = 0
+        self.misses = 0
+#
+    def fill(self, entries):
+        """Add (key, lines) entries ahead of use, without counting them as misses."""
+        for key, lines in entries:
+            self.frames[key] = self.prepare(lines)
+#
+    def get(self, key, build, *args):
+        """The screen for key, calling build(*args) for its lines the first time it is needed."""
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+            frame = self.frames[key] = self.prepare(build(*args))
+        else:
+            self.hits += 1
+        return frame
+#
+    def prepare(self, lines):
+        """Rows as padded strings, or tuples of strings and bitmaps padded to the width."""
+        frame = []
+        for line in lines:
+            if isinstance(line, str):
+                frame.append(line[:self.width].ljust(self.width))
+                continue
+            parts, length = [], 0
+            for part in line:
+                size = len(part) if isinstance(part, str) else 1
+                if length + size > self.width:
+                    part = part[:self.width - length] if isinstance(part, str) else ""
+                    size = len(part)
+                if part:
+                    parts.append(part)
+                length += size
+            if length < self.width:
+                parts.append(" " * (self.width - length))
+            frame.append(tuple(parts))
+        return tuple(frame)
+#
+    def stats(self):
+        return "Screen cache {} screens, {} hits, {} misses".format(len(self.frames), self.hits, self.misses)
+
+
+class LCDWriter(object):
+    """Owns the LCD: runs queued display commands, in order, on its own thread.
+
+    Callers return as soon as a command is queued.  A new frame replaces any frame or
+    display shift still waiting in the queue, so a fast scroll only draws the last screen.
+    Until start() is called commands run straight away on the caller's thread, which
+    keeps scripted runs and benchmarks repeatable.
+    """
+    def __init__(self, frame):
+        self.frame = frame
+        self.commands = deque()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = False
+        self.thread = None
+        self.submitted = 0
+        self.dropped = 0                        # Frames and shifts superseded before drawing
+        self.executed = 0
+        self.max_depth = 0
+        self.render_count = 0
+        self.render_time = 0.0
+        self.render_max = 0.0
+#
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="LCDWriter", daemon=True)
+        self.thread.start()
+#
+    def stop(self):
+        """Draw everything still queued, then stop the thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+#
+    def submit(self, name, *args):
+        """Queue a FrameBuffer method, or any other LCD call, by name."""
+        if self.thread is None:
+            self.submitted += 1
+            self.execute(name, args)
+            return
+        with self.condition:
+            if name == 'render':
+                kept = deque(command for command in self.commands if command[0] not in SUPERSEDED)
+                self.dropped += len(self.commands) - len(kept)
+                self.commands = kept
+            self.commands.append((name, args))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self.commands))
+            self.condition.notify_all()
+#
+    def call(self, function):
+        """Queue function to run once everything queued before it is on the display."""
+        self.submit('call', function)
+#
+    def flush(self):
+        """Block until the queue is empty and the last command has been drawn."""
+        with self.condition:
+            while self.commands or self.busy:
+                self.condition.wait()
+#
+    @property
+    def depth(self):
+        return len(self.commands)
+#
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.commands and self.running:
+                    self.condition.wait()
+                if not self.commands:
+                    return
+                name, args = self.commands.popleft()
+                self.busy = True
+            try:
+                self.execute(name, args)
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+#
+    def execute(self, name, args):
+        start = perf_counter()
+        if name == 'call':
+            args[0]()
+        elif hasattr(self.frame, name):
+            getattr(self.frame, name)(*args)
+        else:
+            getattr(self.frame.lcd, name)(*args)
+            self.frame.bus_writes += 1
+        self.executed += 1
+        if name == 'render':
+            elapsed = perf_counter() - start
+            self.render_count += 1
+            self.render_time += elapsed
+            self.render_max = max(self.render_max, elapsed)
+#
+    def stats(self):
+        mean = self.render_time / self.render_count if self.render_count else 0.0
+        return ("Queued {}, drawn {}, superseded {}, depth {} (max {}), "
+                "render mean {:.2f} ms max {:.2f} ms".format(
+                    self.submitted, self.executed, self.dropped, self.depth, self.max_depth,
+                    mean * 1000, self.render_max * 1000))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# Game mode puzzles for the I Ching Hexagrams PiFaceCAD program.
+#
+# Each GAME_MENU mode asks multiple choice questions built from the hexagram and trigram
+# tables, one choice for each of the four item switches:
+#
+#   Lines     - a line value (6, 7, 8 or 9) to Young or Old Yin or Yang
+#   Trigrams  - three line values, bottom first, to their trigram
+#   Hexagram  - an upper and lower trigram to their hexagram
+#   Full      - six cast line values, bottom first, to the relating hexagram
+#
+# Answers are checked against SOLUTIONS, tuples indexed by the question's key and built once
+# when the module is imported, so every check is one index and one comparison.  A round's
+# questions, and the screens for each choice, are made before the round starts and the next
+# round is made while the current one is played, so answering never waits on the tables.
+#
+#   python3 ichinggame.py check           - check SOLUTIONS against the tables line by line
+#   python3 ichinggame.py benchmark       - time checks and round generation
+#
+
+import random
+import sys
+from collections import namedtuple
+from time import perf_counter
+
+from ichingbackend import load_backend
+from ichinghexagrams import (HEXAGRAMS, HEXAGRAM_COUNT, KING_WEN, LINE_COUNT, LINE_VALUES,
+                             TRIGRAMS, TRIGRAM_MASK, Casting, from_trigrams, relating)
+
+GAME_MODES = ("Lines", "Trigrams", "Hexagram", "Full")
+ROUND_SIZE = 5              # Questions in a round
+CHOICES = 4                 # One for each item switch
+LINE_NAMES = ("Young Yin", "Old Yin", "Young Yang", "Old Yang")     # By yang << 1 | moving
+
+Question = namedtuple('Question', ['mode', 'key', 'prompt', 'choices', 'answer', 'screens'])
+
+
+def line_code(value):                   # yang << 1 | moving for a line value
+    return LINE_VALUES.index(value)
+
+
+def values_key(values):                 # Line codes of values packed two bits each, bottom line first
+    key = 0
+    for line, value in enumerate(values):
+        key |= line_code(value) << 2 * line
+    return key
+
+
+def key_values(key, lines):
+    return tuple(LINE_VALUES[key >> 2 * line & 3] for line in range(lines))
+
+
+def key_yang(key, lines):               # Yang mask of values packed by values_key()
+    return sum((key >> 2 * line + 1 & 1) << line for line in range(lines))
+
+
+def key_moving(key, lines):
+    return sum((key >> 2 * line & 1) << line for line in range(lines))
+
+
+#
+#   The solution index.  Each mode's answers are a tuple indexed by the question key:
+#   Lines by line value, Trigrams by values_key() of three values, Hexagram by
+#   upper << 3 | lower trigram mask and Full by values_key() of six values.
+#
+
+LINE_SOLUTIONS = tuple(line_code(value) if value in LINE_VALUES else None for value in range(10))
+TRIGRAM_SOLUTIONS = tuple(key_yang(key, 3) for key in range(1 << 6))
+HEXAGRAM_SOLUTIONS = tuple(KING_WEN[mask] for mask in range(HEXAGRAM_COUNT))
+FULL_SOLUTIONS = tuple(KING_WEN[key_yang(key, LINE_COUNT) ^ key_moving(key, LINE_COUNT)]
+                       for key in range(1 << 2 * LINE_COUNT))
+SOLUTIONS = {
+    "Lines": LINE_SOLUTIONS,
+    "Trigrams": TRIGRAM_SOLUTIONS,
+    "Hexagram": HEXAGRAM_SOLUTIONS,
+    "Full": FULL_SOLUTIONS,
+}
+ANSWERS = {                             # Every possible answer of each mode, and its label
+    "Lines": tuple(enumerate(LINE_NAMES)),
+    "Trigrams": tuple((trigram.mask, trigram.name) for trigram in TRIGRAMS),
+    "Hexagram": tuple((number, "{} {}".format(number, HEXAGRAMS[number].name))
+                      for number in range(1, HEXAGRAM_COUNT + 1)),
+}
+ANSWERS["Full"] = ANSWERS["Hexagram"]
+
+
+def check(mode, key, answer):
+    """True if answer is the solution of mode's question key."""
+    return SOLUTIONS[mode][key] == answer
+
+
+def question_key(mode, rng):            # A random question of mode and its prompt
+    if mode == "Lines":
+        value = rng.choice(LINE_VALUES)
+        return value, "Line {} is?".format(value)
+    if mode == "Trigrams":
+        values = [rng.choice(LINE_VALUES) for line in range(3)]
+        return values_key(values), "Lines {} {} {} =?".format(*values)
+    if mode == "Hexagram":
+        lower, upper = rng.randrange(8), rng.randrange(8)
+        return upper << 3 | lower, "{}/{} =?".format(TRIGRAMS[upper].name, TRIGRAMS[lower].name)
+    if mode == "Full":
+        values = [rng.choice(LINE_VALUES) for line in range(LINE_COUNT)]
+        return values_key(values), "{} turns to?".format("".join(str(value) for value in values))
+    raise ValueError("{!r} is not a game mode".format(mode))
+
+
+def make_question(mode, rng, width):
+    """A question with the solution and three other answers, in a random order, for a display width wide."""
+    key, prompt = question_key(mode, rng)
+    solution = SOLUTIONS[mode][key]
+    answers = ANSWERS[mode]
+    others = [answer for answer in rng.sample(answers, CHOICES) if answer[0] != solution][:CHOICES - 1]
+    choices = others + [answer for answer in answers if answer[0] == solution]
+    rng.shuffle(choices)
+    screens = tuple((prompt, "{}:{}".format(index + 1, label)[:width].ljust(width))
+                    for index, (answer, label) in enumerate(choices))
+    return Question(mode, key, prompt, tuple(answer for answer, label in choices),
+                    [answer for answer, label in choices].index(solution), screens)
+
+
+def make_round(mode, rng, width, size=ROUND_SIZE):
+    return tuple(make_question(mode, rng, width) for index in range(size))
+
+
+class Game(object):
+    """A round of questions on the LCD: item switches choose, Select answers and moves on.
+
+    show(topline, botline) draws a screen width characters wide.  Each round starts with call_later(0, prepare,
+    mode), so the next round is made between screens; without call_later it is made when
+    the round starts.
+    """
+    def __init__(self, show, width, call_later=None, rng=None):
+        self.show = show
+        self.width = width
+        self.call_later = call_later
+        self.rng = rng or random.Random()
+        self.upcoming = {}                  # Mode to its next round, made ahead of time
+        self.mode = None
+        self.questions = ()
+        self.index = 0                      # Question on screen
+        self.choice = 0                     # Choice on screen
+        self.answered = False               # The answer to the question on screen has been shown
+        self.score = 0
+#
+    def prepare(self, mode):
+        if mode not in self.upcoming:
+            self.upcoming[mode] = make_round(mode, self.rng, self.width)
+#
+    def start(self, mode):
+        self.prepare(mode)
+        self.mode = mode
+        self.questions = self.upcoming.pop(mode)
+        self.index = self.choice = self.score = 0
+        self.answered = False
+        self.draw()
+        if self.call_later is not None:
+            self.call_later(0, self.prepare, mode)
+#
+    @property
+    def question(self):
+        return self.questions[self.index]
+#
+    @property
+    def finished(self):
+        return self.index >= len(self.questions)
+#
+    def draw(self):
+        if self.finished:
+            self.show("Score {} of {}".format(self.score, len(self.questions)), " Select = Again")
+        elif self.answered:
+            question = self.question
+            right = check(self.mode, question.key, question.choices[self.choice])
+            self.show("{} {} of {}".format("Right!" if right else "Wrong.", self.score, self.index + 1),
+                      question.screens[question.answer][1])
+        else:
+            self.show(*self.question.screens[self.choice])
+#
+    def choose(self, choice):               # Item switch or remote number
+        if not self.finished and not self.answered:
+            self.choice = choice % CHOICES
+            self.draw()
+#
+    def move(self, steps):                  # Next or Previous
+        self.choose(self.choice + steps)
+#
+    def select(self):
+        """Answer the question on screen, or go on to the next question or round."""
+        if self.finished:
+            self.start(self.mode)
+            return
+        if self.answered:
+            self.index += 1
+            self.choice = 0
+            self.answered = False
+        else:
+            question = self.question
+            self.score += check(self.mode, question.key, question.choices[self.choice])
+            self.answered = True
+        self.draw()
+
+
+CLI_WIDTH = load_backend("simulator").LCD_WIDTH     # Screens for check and benchmark, sized as the simulator's
+
+
+def check_solutions():
+    """Check SOLUTIONS against the tables, returns a list of problems."""
+    problems = []
+    for value in LINE_VALUES:
+        casting = Casting.from_values((value,) * LINE_COUNT)
+        if LINE_SOLUTIONS[value] != casting.line_code(0):
+            problems.append("Line {} is wrong".format(value))
+    for key in range(1 << 6):
+        values = key_values(key, 3) + (8, 8, 8)
+        if TRIGRAM_SOLUTIONS[key] != Casting.from_values(values).yang & TRIGRAM_MASK:
+            problems.append("Trigram of lines {} is wrong".format(key_values(key, 3)))
+    for lower in range(8):
+        for upper in range(8):
+            if HEXAGRAM_SOLUTIONS[upper << 3 | lower] != from_trigrams(lower, upper).number:
+                problems.append("Hexagram of {}/{} is wrong".format(TRIGRAMS[upper].name, TRIGRAMS[lower].name))
+    for key in range(1 << 2 * LINE_COUNT):
+        casting = Casting.from_values(key_values(key, LINE_COUNT))
+        if FULL_SOLUTIONS[key] != relating(casting.yang, casting.moving).number:
+            problems.append("Relating hexagram of {} is wrong".format(casting.values))
+    rng = random.Random(1)
+    for mode in GAME_MODES:
+        for question in make_round(mode, rng, CLI_WIDTH, 1000):
+            if len(set(question.choices)) != CHOICES or not check(mode, question.key, question.choices[question.answer]):
+                problems.append("{} question {!r} is wrong".format(mode, question.prompt))
+                break
+    return problems
+
+
+def benchmark(count=100000):
+    rng = random.Random(1)
+    for mode in GAME_MODES:
+        questions = make_round(mode, rng, CLI_WIDTH, 1000)
+        keys = [(question.key, question.choices[0]) for question in questions] * (count // 1000)
+        start = perf_counter()
+        for key, answer in keys:
+            check(mode, key, answer)
+        checked = perf_counter() - start
+        start = perf_counter()
+        for index in range(1000):
+            make_round(mode, rng, CLI_WIDTH)
+        made = perf_counter() - start
+        print("{:9} check {:.3f} us, round of {} made in {:.1f} us".format(
+            mode, checked / len(keys) * 1e6, ROUND_SIZE, made / 1000 * 1e6))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        problems = check_solutions()
+        print("\n".join(problems) or "Game solutions OK")
+        sys.exit(1 if problems else 0)
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    else:
+        print("usage: ichinggame.py check | benchmark")
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+#
+# King Wen table of the 64 Hexagrams, indexed by line mask.
+#
+# A hexagram is held as a 6 bit mask, bit 0 is the bottom line and bit 5 the top line,
+# with 1 for a yang (solid) line and 0 for a yin (broken) line.  The lower trigram is
+# mask & 7 and the upper trigram is mask >> 3, so every lookup is a list index.
+#
+# A cast hexagram (Casting) adds a second mask marking the moving (old) lines, so
+# transforming it to the relating hexagram is yang ^ moving.  The *_batch functions do
+# the same over NumPy arrays of masks when NumPy is installed, NumPy is only imported when
+# one of them first runs as it takes longer to import than the rest of the program.
+#
+# The table is loaded from hexagrams.dat, rebuild it with:  python3 ichinghexagrams.py build
+# and check it with:  python3 ichinghexagrams.py validate
+#
+
+import os
+import sys
+from collections import namedtuple
+
+np = None                                       # NumPy once need_numpy() has imported it
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hexagrams.dat")
+TABLE_MAGIC = b"HEX1"
+
+HEXAGRAM_COUNT = 64
+LINE_COUNT = 6
+LINE_MASK = 0b111111
+TRIGRAM_MASK = 0b111
+
+# 5x8 Custom Bitmap hexagram construction values, one LCD row per line
+
+blank_space_bits = 0b00000          # Top and bottom lines of 5x8 display will always be blank
+old_yang_bits = 0b10101             # Short-form of '--0--' to fit LCD limitations = 21 Decimal
+young_yang_bits = 0b11111           # Short-form of '-----' to fit LCD limitations = 31 Decimal
+old_yin_bits = 0b10001              # Short-form of '--X--' to fit LCD limitations = 17 Decimal
+young_yin_bits = 0b11011            # Short-form of '-- --' to fit LCD limitations = 27 Decimal
+
+LINE_BITS = (young_yin_bits, old_yin_bits, young_yang_bits, old_yang_bits)  # By yang << 1 | moving
+LINE_VALUES = (8, 6, 7, 9)                                                  # By yang << 1 | moving
+
+Trigram = namedtuple('Trigram', ['mask', 'name', 'image'])
+Hexagram = namedtuple('Hexagram', ['number', 'name', 'meaning', 'mask', 'lower', 'upper'])
+
+TRIGRAMS = (                                    # Indexed by 3 bit mask, bottom line first
+    Trigram(0b000, "K'un", "Earth"),
+    Trigram(0b001, "Chen", "Thunder"),
+    Trigram(0b010, "K'an", "Water"),
+    Trigram(0b011, "Tui", "Lake"),
+    Trigram(0b100, "Ken", "Mountain"),
+    Trigram(0b101, "Li", "Fire"),
+    Trigram(0b110, "Sun", "Wind"),
+    Trigram(0b111, "Ch'ien", "Heaven"),
+)
+
+#
+#   Source data for hexagrams.dat.  KING_WEN_GRID gives the King Wen number for each
+#   upper (row) and lower (column) trigram, both in the order of GRID_ORDER.
+#
+
+GRID_ORDER = (0b111, 0b001, 0b010, 0b100, 0b000, 0b110, 0b101, 0b011)
+KING_WEN_GRID = (
+    (1, 25, 6, 33, 12, 44, 13, 10),
+    (34, 51, 40, 62, 16, 32, 55, 54),
+    (5, 3, 29, 39, 8, 48, 63, 60),
+    (26, 27, 4, 52, 23, 18, 22, 41),
+    (11, 24, 7, 15, 2, 46, 36, 19),
+    (9, 42, 59, 53, 20, 57, 37, 61),
+    (14, 21, 64, 56, 35, 50, 30, 38),
+    (43, 17, 47, 31, 45, 28, 49, 58),
+)
+HEXAGRAM_NAMES = (                              # (name, meaning) in King Wen order
+    ("Ch'ien", "The Creative"),
+    ("K'un", "The Receptive"),
+    ("Chun", "Difficulty at the Beginning"),
+    ("Meng", "Youthful Folly"),
+    ("Hsu", "Waiting (Nourishment)"),
+    ("Sung", "Conflict"),
+    ("Shih", "The Army"),
+    ("Pi", "Holding Together (Union)"),
+    ("Hsiao Ch'u", "The Taming Power of the Small"),
+    ("Lu", "Treading (Conduct)"),
+    ("T'ai", "Peace"),
+    ("P'i", "Standstill (Stagnation)"),
+    ("T'ung Jen", "Fellowship with Men"),
+    ("Ta Yu", "Possession in Great Measure"),
+    ("Ch'ien", "Modesty"),
+    ("Yu", "Enthusiasm"),
+    ("Sui", "Following"),
+    ("Ku", "Work on What Has Been Spoiled"),
+    ("Lin", "Approach"),
+    ("Kuan", "Contemplation (View)"),
+    ("Shih Ho", "Biting Through"),
+    ("Pi", "Grace"),
+    ("Po", "Splitting Apart"),
+    ("Fu", "Change (Turning Point)"),
+    ("Wu Wang", "Innocence (The Unexpected)"),
+    ("Ta Ch'u", "The Taming Power of the Great"),
+    ("I", "The Corners of the Mouth"),
+    ("Ta Kuo", "Preponderance of the Great"),
+    ("K'an", "The Abysmal (Water)"),
+    ("Li", "The Clinging, Fire"),
+    ("Hsien", "Influence (Wooing)"),
+    ("Heng", "Duration"),
+    ("Tun", "Retreat"),
+    ("Ta Chuang", "The Power of the Great"),
+    ("Chin", "Progress"),
+    ("Ming I", "Darkening of the Light"),
+    ("Chia Jen", "The Family"),
+    ("K'uei", "Opposition"),
+    ("Chien", "Obstruction"),
+    ("Hsieh", "Deliverance"),
+    ("Sun", "Decrease"),
+    ("I", "Increase"),
+    ("Kuai", "Break-through (Resoluteness)"),
+    ("Kou", "Coming to Meet"),
+    ("Ts'ui", "Gathering Together (Massing)"),
+    ("Sheng", "Pushing Upward"),
+    ("K'un", "Oppression (Exhaustion)"),
+    ("Ching", "The Well"),
+    ("Ko", "Revolution (Molting)"),
+    ("Ting", "The Caldron"),
+    ("Chen", "The Arousing (Shock, Thunder)"),
+    ("Ken", "Keeping Still, Mountain"),
+    ("Chien", "Development (Gradual Progress)"),
+    ("Kuei Mei", "The Marrying Maiden"),
+    ("Feng", "Abundance (Fullness)"),
+    ("Lu", "The Wanderer"),
+    ("Sun", "The Gentle (Wind)"),
+    ("Tui", "The Joyous, Lake"),
+    ("Huan", "Dispersion (Dissolution)"),
+    ("Chieh", "Limitation"),
+    ("Chung Fu", "Inner Truth"),
+    ("Hsiao Kuo", "Preponderance of the Small"),
+    ("Chi Chi", "After Completion"),
+    ("Wei Chi", "Before Completion"),
+)
+
+
+def build_table(path=TABLE_FILE):
+    """Write hexagrams.dat from the source data above.
+
+    Layout: TABLE_MAGIC, then 64 bytes holding the line mask of hexagrams 1 to 64, then
+    the names and meanings as UTF-8, one per line, in King Wen order.
+    """
+    masks = bytearray(HEXAGRAM_COUNT)
+    for row, upper in enumerate(GRID_ORDER):
+        for col, lower in enumerate(GRID_ORDER):
+            masks[KING_WEN_GRID[row][col] - 1] = upper << 3 | lower
+    text = "\n".join(field for pair in HEXAGRAM_NAMES for field in pair)
+    with open(path, "wb") as table:
+        table.write(TABLE_MAGIC + bytes(masks) + text.encode('utf-8'))
+
+
+def load_table(path=TABLE_FILE):
+    """Read hexagrams.dat and return (HEXAGRAMS, KING_WEN).
+
+    HEXAGRAMS is indexed by King Wen number (entry 0 is None) and KING_WEN by line mask.
+    """
+    with open(path, "rb") as table:
+        data = table.read()
+    if data[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+        raise ValueError("{} is not a hexagram table".format(path))
+    start = len(TABLE_MAGIC)
+    masks = data[start:start + HEXAGRAM_COUNT]
+    fields = data[start + HEXAGRAM_COUNT:].decode('utf-8').split("\n")
+    if len(masks) != HEXAGRAM_COUNT or len(fields) != 2 * HEXAGRAM_COUNT:
+        raise ValueError("{} is truncated".format(path))
+    hexagrams = [None]
+    king_wen = [0] * HEXAGRAM_COUNT
+    for number in range(1, HEXAGRAM_COUNT + 1):
+        mask = masks[number - 1]
+        hexagrams.append(Hexagram(number, fields[2 * number - 2], fields[2 * number - 1],
+                                  mask, mask & TRIGRAM_MASK, mask >> 3))
+        king_wen[mask] = number
+    return tuple(hexagrams), tuple(king_wen)
+
+
+try:
+    HEXAGRAMS, KING_WEN = load_table()
+except FileNotFoundError:
+    if not (__name__ == "__main__" and "build" in sys.argv):    # Building is how the file is made
+        raise
+
+
+def lookup(mask):
+    """Return the Hexagram for a 6 bit line mask."""
+    return HEXAGRAMS[KING_WEN[mask]]
+
+
+def from_trigrams(lower, upper):
+    """Return the Hexagram built from two 3 bit trigram masks."""
+    return HEXAGRAMS[KING_WEN[upper << 3 | lower]]
+
+
+def relating(mask, moving):
+    """Return the Hexagram reached when the moving lines of mask change."""
+    return HEXAGRAMS[KING_WEN[mask ^ moving]]
+
+
+CHANGING_LINES = tuple(tuple(line + 1 for line in range(LINE_COUNT) if moving >> line & 1)
+                       for moving in range(HEXAGRAM_COUNT))     # Line numbers, by moving mask
+
+
+def nuclear_mask(mask):
+    """Mask of the nuclear hexagram: lines 2-4 below lines 3-5."""
+    return (mask >> 1 & TRIGRAM_MASK) | (mask >> 2 & TRIGRAM_MASK) << 3
+
+
+class Casting(object):
+    """A cast hexagram held as two 6 bit masks, one for yang lines and one for moving lines."""
+    __slots__ = ('yang', 'moving')
+#
+    def __init__(self, yang, moving=0):
+        self.yang = yang & LINE_MASK
+        self.moving = moving & LINE_MASK
+#
+    @classmethod
+    def from_values(cls, values):
+        """Build from six line values (6, 7, 8 or 9), bottom line first."""
+        yang = moving = 0
+        for line, value in enumerate(values):
+            if value not in LINE_VALUES:
+                raise ValueError("Line value must be 6, 7, 8 or 9, not {!r}".format(value))
+            yang |= (value & 1) << line
+            moving |= (value in (6, 9)) << line
+        return cls(yang, moving)
+#
+    def line_code(self, line):                  # yang << 1 | moving for line 0 (bottom) to 5
+        return (self.yang >> line & 1) << 1 | (self.moving >> line & 1)
+#
+    @property
+    def values(self):
+        return tuple(LINE_VALUES[self.line_code(line)] for line in range(LINE_COUNT))
+#
+    @property
+    def primary(self):
+        return HEXAGRAMS[KING_WEN[self.yang]]
+#
+    @property
+    def relating(self):
+        return HEXAGRAMS[KING_WEN[self.yang ^ self.moving]]
+#
+    @property
+    def nuclear(self):
+        return HEXAGRAMS[KING_WEN[nuclear_mask(self.yang)]]
+#
+    @property
+    def changing_lines(self):
+        return CHANGING_LINES[self.moving]
+#
+    def transformed(self):
+        """Old Yang becomes Young Yin and Old Yin becomes Young Yang."""
+        return Casting(self.yang ^ self.moving, 0)
+#
+    def lcd_rows(self):
+        """The 8 row custom bitmap for the LCD, top line at the top, blank rows above and below."""
+        return ([blank_space_bits] +
+                [LINE_BITS[self.line_code(line)] for line in range(LINE_COUNT - 1, -1, -1)] +
+                [blank_space_bits])
+#
+    def __eq__(self, other):
+        return isinstance(other, Casting) and (self.yang, self.moving) == (other.yang, other.moving)
+#
+    def __hash__(self):
+        return hash((self.yang, self.moving))
+#
+    def __repr__(self):
+        return "Casting({:#08b}, {:#08b})".format(self.yang, self.moving)
+
+
+def need_numpy():
+    """Import NumPy on first use and return it."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:                     # Only the batch functions need NumPy
+            raise RuntimeError("NumPy is needed for batch hexagram operations")
+        np = numpy
+    return np
+
+
+def have_numpy():
+    try:
+        need_numpy()
+    except RuntimeError:
+        return False
+    return True
+
+
+def transform_batch(yang, moving, out=None):
+    """Relating hexagram masks for arrays of (yang, moving) masks, written to out if given."""
+    np = need_numpy()
+    return np.bitwise_xor(yang, moving, out=out)
+
+
+def nuclear_batch(yang):
+    """Nuclear hexagram masks for an array of yang masks."""
+    need_numpy()
+    return (yang >> 1 & TRIGRAM_MASK) | (yang >> 2 & TRIGRAM_MASK) << 3
+
+
+def king_wen_batch(masks):
+    """King Wen numbers for an array of line masks."""
+    np = need_numpy()
+    return np.asarray(KING_WEN, dtype=np.uint8)[masks]
+
+
+KNOWN_CASTINGS = (                              # Line values, bottom first, with their hexagram and relating hexagram
+    ((7, 7, 7, 7, 7, 7), 1, 1),
+    ((9, 9, 9, 9, 9, 9), 1, 2),
+    ((6, 6, 6, 6, 6, 6), 2, 1),
+    ((9, 7, 7, 7, 7, 7), 1, 44),
+    ((7, 7, 7, 7, 7, 9), 1, 43),
+    ((6, 8, 8, 8, 8, 8), 2, 24),
+    ((8, 8, 8, 8, 8, 6), 2, 23),
+    ((9, 7, 7, 8, 8, 8), 11, 46),
+    ((7, 9, 8, 9, 8, 8), 54, 24),
+    ((9, 6, 9, 6, 9, 6), 63, 64),
+)
+
+
+def validate():
+    """Check the loaded table, returns a list of problems (empty when all is well)."""
+    problems = []
+    if sorted(KING_WEN) != list(range(1, HEXAGRAM_COUNT + 1)):
+        problems.append("KING_WEN is not a permutation of 1-64")
+    for hexagram in HEXAGRAMS[1:]:
+        if KING_WEN[hexagram.mask] != hexagram.number:
+            problems.append("Hexagram {} does not round trip".format(hexagram.number))
+        if hexagram.lower | hexagram.upper << 3 != hexagram.mask:
+            problems.append("Hexagram {} trigrams do not match".format(hexagram.number))
+    for number in range(1, HEXAGRAM_COUNT + 1, 2):
+        first, second = HEXAGRAMS[number].mask, HEXAGRAMS[number + 1].mask
+        inverted = int(format(first, "06b")[::-1], 2)
+        if second != (inverted if inverted != first else first ^ LINE_MASK):
+            problems.append("Hexagrams {} and {} are not a King Wen pair".format(number, number + 1))
+    for values, number, relating_number in KNOWN_CASTINGS:
+        casting = Casting.from_values(values)
+        if casting.primary.number != number or casting.relating.number != relating_number:
+            problems.append("Casting {} should be hexagram {} changing to {}".format(values, number, relating_number))
+        if casting.transformed().primary.number != relating_number:
+            problems.append("Casting {} should transform to hexagram {}".format(values, relating_number))
+    for number, lower, upper in ((1, 0b111, 0b111), (2, 0b000, 0b000), (24, 0b001, 0b000),
+                                 (54, 0b011, 0b001), (63, 0b101, 0b010), (64, 0b010, 0b101)):
+        if from_trigrams(lower, upper).number != number:
+            problems.append("Hexagram {} has the wrong trigrams".format(number))
+    for yang in range(HEXAGRAM_COUNT):          # Every casting against its line by line definition
+        for moving in range(HEXAGRAM_COUNT):
+            casting = Casting(yang, moving)
+            if Casting.from_values(casting.values) != casting:
+                problems.append("{!r} does not round trip through its values".format(casting))
+            if casting.transformed().yang != relating(yang, moving).mask:
+                problems.append("{!r} transforms to the wrong hexagram".format(casting))
+    return problems
+
+
+if __name__ == "__main__":
+    if "build" in sys.argv:
+        build_table()
+        print("Wrote " + TABLE_FILE)
+    elif "validate" in sys.argv:
+        problems = validate()
+        for problem in problems:
+            print(problem)
+        print("{} problems in {} hexagrams and {} known castings".format(
+            len(problems), HEXAGRAM_COUNT, len(KNOWN_CASTINGS)))
+        sys.exit(1 if problems else 0)
+    else:
+        print("usage: ichinghexagrams.py build|validate")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Many virtual I Ching consoles in one asyncio process, for kiosks and load tests.
+#
+# Each console is an ichingmenus.Session on its own simulated board, with its LCD writer
+# running on the event loop, and its own input queue.  A console's task waits on that queue
+# only until its scheduler's next deadline, so splash and scrolling text frames and the Quit
+# time out keep running, and handles each button press as soon as it arrives.  A kiosk
+# console never quits: a confirmed Quit starts its main menu again.
+#
+# The load test feeds every console random button presses and reports the time from a press
+# being queued to its screen being written, for a growing number of consoles:
+#
+#   python3 ichinghost.py [sessions ...] [--seconds S] [--rate R]
+#
+# R is the presses per second per console, the defaults run 1, 10, 100, 500 and 1000 consoles
+# for 5 seconds at 2 presses a second.
+#
+
+import asyncio
+import os
+import random
+import sys
+from time import monotonic
+
+os.environ.setdefault("ICHING_BACKEND", "simulator")
+
+import ichingmenus
+from ichingdisplay import FrameCache
+
+SESSION_COUNTS = (1, 10, 100, 500, 1000)
+SECONDS = 5.0
+RATE = 2.0                                      # Presses per second per console
+INPUTS = ([('switch', pin) for pin in range(8)] +      # Every switch, 5 is Select and 4 is Back
+          [('ir', code) for code in range(4)])         # and the remote's item buttons
+BACK = ('switch', 4)
+
+
+def start_session(screens):
+    """A Session on its own simulated board, at the top level menu."""
+    session = ichingmenus.Session(ichingmenus.backend.PiFaceCAD(), threaded=False)
+    session.display_lcd.screens = screens       # Every console shows the same screens
+    session.listeners = ichingmenus.register_listeners(session)     # Switches and remote of its own board
+    session.display_lcd.splash = False
+    session.menus.waiting = False
+    session.menus.active = True
+    session.menus.begin_menu()
+    return session
+
+
+async def run_session(session, inputs, samples):
+    """Handle presses from inputs until it yields None, recording press to screen times."""
+    scheduler = session.scheduler
+    lcd = session.cad.lcd
+    while True:
+        try:
+            press = await asyncio.wait_for(inputs.get(), scheduler.timeout())
+        except asyncio.TimeoutError:
+            scheduler.run_due()                 # Animation frame or time out
+            continue
+        if press is None:
+            break
+        (source, code), posted = press
+        writes = lcd.bus_writes
+        if source == 'ir':
+            session.cad.press_ir(code)
+        else:
+            session.cad.press(code)
+        if not ichingmenus.run_pending(session):    # Quit confirmed, start again
+            session.menus.active = True
+            session.menus.begin_menu()
+        if lcd.bus_writes != writes:            # Only presses that changed the screen count
+            samples.append(monotonic() - posted)
+
+
+async def feed(session, inputs, seconds, rate, rng):
+    """Queue random presses at about rate a second for seconds."""
+    end = monotonic() + seconds
+    while True:
+        delay = rng.expovariate(rate)
+        if monotonic() + delay > end:
+            break
+        await asyncio.sleep(delay)
+        button = BACK if session.menus.exit_pending else rng.choice(INPUTS)
+        inputs.put_nowait((button, monotonic()))
+    inputs.put_nowait(None)
+
+
+async def host(count, seconds=SECONDS, rate=RATE, seed=1):
+    """Run count consoles under random input, returns (latency samples, sessions)."""
+    screens = FrameCache(ichingmenus.LCD_WIDTH)
+    ichingmenus.fill_screens(screens)
+    rng = random.Random(seed)
+    sessions = [start_session(screens) for index in range(count)]
+    samples = []
+    tasks = []
+    for session in sessions:
+        inputs = asyncio.Queue()
+        tasks.append(run_session(session, inputs, samples))
+        tasks.append(feed(session, inputs, seconds, rate, random.Random(rng.random())))
+    await asyncio.gather(*tasks)
+    for session in sessions:
+        switchlistener, irlistener, irlistener_activated = session.listeners
+        switchlistener.deactivate()
+        irlistener.deactivate()
+        session.menus.close()
+    return samples, sessions
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def load_test(counts=SESSION_COUNTS, seconds=SECONDS, rate=RATE):
+    print("sessions  presses  per second   p50 ms   p95 ms   p99 ms   max ms")
+    for count in counts:
+        samples, sessions = asyncio.run(host(count, seconds, rate))
+        if not samples:
+            print("{:8}  no screen changes".format(count))
+            continue
+        ordered = sorted(samples)
+        print("{:8} {:8} {:11.0f} {:8.2f} {:8.2f} {:8.2f} {:8.2f}".format(
+            count, len(ordered), len(ordered) / seconds,
+            percentile(ordered, 0.50) * 1000, percentile(ordered, 0.95) * 1000,
+            percentile(ordered, 0.99) * 1000, ordered[-1] * 1000))
+
+
+def option(name, default):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+        sys.exit("{} needs a value".format(name))
+    return default
+
+
+if __name__ == "__main__":
+    seconds = float(option("--seconds", SECONDS))
+    rate = float(option("--rate", RATE))
+    args = sys.argv[1:]
+    for name in ("--seconds", "--rate"):
+        if name in args:
+            del args[args.index(name):args.index(name) + 2]
+    if [arg for arg in args if not arg.isdigit()]:
+        print("usage: ichinghost.py [sessions ...] [--seconds S] [--rate R]")
+    else:
+        load_test([int(arg) for arg in args] or SESSION_COUNTS, seconds, rate)
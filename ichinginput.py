@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Input layer for the I Ching Hexagrams PiFaceCAD program.
+#
+# Every switch and remote control callback goes through an InputFilter before it reaches
+# the menus:
+#
+#   debounce     - a press from the same source within its debounce time of the last one
+#                  is contact bounce and is dropped
+#   repeats      - for sources that send repeat codes while a button is held, as LIRC does
+#                  for the remote, presses less than REPEAT_WINDOW apart are one held
+#                  button.  Next and Previous repeats are accelerated, repeats of anything
+#                  else dropped.  The switches only report presses, so quick taps on them
+#                  are separate presses and always move one step each
+#   coalescing   - Next and Previous steps add up until the main loop takes them, so a
+#                  burst of presses moves the menu once and draws one screen
+#
+# With swapped set, as the navigation setting can ask, Next and Previous change places.  Every
+# press that is not bounce is timed in last_press and passed to on_press, if set.
+#
+# Nothing is dropped silently: each source counts its raw, bounced, repeated, delivered,
+# coalesced and dropped presses for report().
+#
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+SWITCH_DEBOUNCE = 0.03      # 30 ms of contact bounce after a switch press
+IR_DEBOUNCE = 0.0           # LIRC has already decoded the remote, it does not bounce
+REPEAT_WINDOW = 0.2         # Presses closer than 0.2 seconds are one held button
+ACCELERATE_EVERY = 5        # Step size doubles after every 5 repeats
+MAX_DOUBLINGS = 2           # Up to 4 menu items per repeat
+COUNTS = ('raw', 'bounced', 'repeated', 'delivered', 'coalesced', 'dropped')
+
+
+class InputFilter(object):
+    """Debounces, accelerates and coalesces the presses for one set of Menus.
+
+    Listener callbacks run on the listener threads, steps() runs on the main loop.
+    """
+    def __init__(self, menus, clock=monotonic):
+        self.menus = menus
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last = {}                      # Source to the time of its last accepted press
+        self.streaks = {}                   # Source to the number of repeats in its current hold
+        self.counts = OrderedDict()         # Source to its counts, in the order first pressed
+        self.pending = 0                    # Menu steps not yet taken by the main loop
+        self.sources = []                   # Sources of the pending steps
+        self.posted = False                 # A 'navigate' event is waiting for the main loop
+        self.swapped = False                # Switch 6 is Next and 7 Previous
+        self.last_press = clock()           # Time of the last press that was not bounce
+        self.on_press = None                # Called on the listener thread for each such press
+#
+    def count(self, source, name):
+        self.counts.setdefault(source, dict.fromkeys(COUNTS, 0))[name] += 1
+#
+    def accept(self, source, debounce, repeats=False):
+        """Count a press, returns its repeat number (always 0 unless the source repeats), or None if it is bounce."""
+        now = self.clock()
+        self.count(source, 'raw')
+        last = self.last.get(source)
+        if last is not None and now - last < debounce:
+            self.count(source, 'bounced')
+            return None
+        repeat = repeats and last is not None and now - last < REPEAT_WINDOW
+        self.last[source] = self.last_press = now
+        self.streaks[source] = self.streaks.get(source, 0) + 1 if repeat else 0
+        if repeat:
+            self.count(source, 'repeated')
+        return self.streaks[source]
+#
+    def press(self, source, callback, debounce=SWITCH_DEBOUNCE, repeats=False):
+        """Listener callback for a button with one action, held repeats are dropped."""
+        def pressed(event):
+            with self.lock:
+                streak = self.accept(source, debounce, repeats)
+                deliver = streak == 0
+                if streak:
+                    self.count(source, 'dropped')
+                elif deliver:
+                    self.count(source, 'delivered')
+            if streak is not None and self.on_press is not None:
+                self.on_press()
+            if deliver:
+                self.menus.deliver(callback, event)
+        return pressed
+#
+    def step(self, source, direction, debounce=SWITCH_DEBOUNCE, repeats=False):
+        """Listener callback for Next (direction 1) or Previous (-1), accelerated while held."""
+        def pressed(event):
+            if self.menus.waiting:              # Any press leaves the splash screens
+                self.press(source, self.menus.confirm, debounce, repeats)(event)
+                return
+            with self.lock:
+                streak = self.accept(source, debounce, repeats)
+                if streak is None:
+                    return
+                step = -direction if self.swapped else direction
+                self.pending += step << min(streak // ACCELERATE_EVERY, MAX_DOUBLINGS)
+                self.sources.append(source)
+                post = not self.posted
+                self.posted = True
+            if self.on_press is not None:
+                self.on_press()
+            if post:
+                self.menus.post('navigate')
+        return pressed
+#
+    def steps(self):
+        """Take the steps pressed since the last call, for the main loop."""
+        with self.lock:
+            steps, sources = self.pending, self.sources
+            self.pending, self.sources, self.posted = 0, [], False
+        if sources:
+            moved = self.menus.move(steps)
+            with self.lock:
+                self.count(sources[-1], 'delivered' if moved else 'dropped')
+                for source in sources[:-1]:
+                    self.count(source, 'coalesced' if moved else 'dropped')
+        return steps
+#
+    def report(self):
+        if not self.counts:
+            return "Input: no button presses"
+        return "\n".join("Input {:10} ".format(source) + ", ".join(
+            "{} {}".format(name, counts[name]) for name in COUNTS) for source, counts in self.counts.items())
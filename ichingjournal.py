@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+#
+# Casting journal for the I Ching Hexagrams program.
+#
+# Every casting is appended to a file of fixed width records:
+#
+#   JOURNAL_MAGIC header, then one RECORD per casting:
+#   timestamp (float64 seconds), method, yang mask, moving mask, 0, CRC-32 of the first 12 bytes
+#
+# Appends are written straight away but only fsync()ed every SYNC_EVERY records or
+# SYNC_INTERVAL seconds, as each fsync is slow on an SD card.  Given call_later, as the
+# program's scheduler, an append never fsyncs itself: a timer does SYNC_INTERVAL seconds
+# after the first unsynced record, so a casting never waits for the card.  After a power loss the
+# file is opened with its torn or unsynced tail records cut off, back to the last
+# record whose CRC is good.
+#
+# Records are read through an mmap of the file.  Record numbers are kept by King Wen
+# number and by day, and saved beside the journal (INDEX_SUFFIX) so opening a large
+# journal only has to index the records added since the index was saved.
+#
+#   python3 ichingjournal.py show FILE [number] [year]  - list castings, of one hexagram or year
+#   python3 ichingjournal.py check FILE                 - check every record and rebuild the index
+#   python3 ichingjournal.py benchmark FILE [count]     - append count castings and time queries
+#
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, datetime
+from time import perf_counter, time
+
+from ichinghexagrams import Casting, HEXAGRAM_COUNT, KING_WEN, need_numpy
+
+JOURNAL_MAGIC = b"ICJ1" + bytes(12)             # 16 byte header, keeps the records aligned
+RECORD = struct.Struct("<dBBBBI")               # 16 bytes
+CHECKED = struct.Struct("<dBBBB")               # The part of a record covered by its CRC
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"ICX1"
+INDEX_HEADER = struct.Struct("<4sIII")          # magic, records indexed, days, CRC of the last record
+SYNC_EVERY = 16
+SYNC_INTERVAL = 5.0
+INDEX_SAVE_EVERY = 4096                         # Records appended between saves of the index
+JOURNAL_METHODS = ("Stalks", "Coins", "Dice", "User")   # Method codes, by position
+
+JournalRecord = namedtuple('JournalRecord', ['timestamp', 'method', 'casting'])
+
+
+def pack_record(timestamp, method, casting):
+    head = CHECKED.pack(timestamp, JOURNAL_METHODS.index(method), casting.yang, casting.moving, 0)
+    return head + struct.pack("<I", zlib.crc32(head))
+
+
+def record_valid(data, offset):
+    return zlib.crc32(data[offset:offset + CHECKED.size]) == \
+        struct.unpack_from("<I", data, offset + CHECKED.size)[0]
+
+
+class Journal(object):
+    """Append-only journal of castings, with indexes by hexagram number and by day."""
+    def __init__(self, path, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL, call_later=None):
+        self.path = path
+        self.call_later = call_later            # Schedules the fsyncs, None to fsync as records are appended
+        self.sync_timer = None
+        self.index_path = path + INDEX_SUFFIX
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.count = self.recover()
+        os.lseek(self.fd, 0, os.SEEK_END)
+        self.unsynced = 0
+        self.last_sync = time()
+        self.unsaved = 0                        # Records appended since the index was saved
+        self.map = None
+        self.mapped = 0                         # Records covered by the current mmap
+        self.by_number = [array('I') for number in range(HEXAGRAM_COUNT + 1)]
+        self.by_day = {}                        # date ordinal -> record numbers
+        self.days = None                        # Sorted date ordinals, None when out of date
+        indexed = self.load_index()
+        self.index_records(indexed, self.count)
+        self.unsaved = self.count - indexed
+#
+    def recover(self):
+        """Cut off a torn tail after a crash, returns the number of good records."""
+        size = os.fstat(self.fd).st_size
+        if size < len(JOURNAL_MAGIC) or os.pread(self.fd, len(JOURNAL_MAGIC), 0) != JOURNAL_MAGIC:
+            if size >= len(JOURNAL_MAGIC):
+                raise ValueError("{} is not a casting journal".format(self.path))
+            os.ftruncate(self.fd, 0)            # Header never made it to the card
+            os.pwrite(self.fd, JOURNAL_MAGIC, 0)
+            os.fsync(self.fd)
+            return 0
+        count = (size - len(JOURNAL_MAGIC)) // RECORD.size
+        while count:                            # Unsynced records can be lost or garbled, never earlier ones
+            offset = len(JOURNAL_MAGIC) + (count - 1) * RECORD.size
+            if record_valid(os.pread(self.fd, RECORD.size, offset), 0):
+                break
+            count -= 1
+        end = len(JOURNAL_MAGIC) + count * RECORD.size
+        if end != size:
+            os.ftruncate(self.fd, end)
+            os.fsync(self.fd)
+        return count
+#
+    def __len__(self):
+        return self.count
+#
+    def append(self, casting, method, timestamp=None):
+        """Record a casting, returns its record number."""
+        if timestamp is None:
+            timestamp = time()
+        os.write(self.fd, pack_record(timestamp, method, casting))
+        number = self.count
+        self.count += 1
+        self.add_to_index(number, timestamp, casting.yang)
+        self.unsynced += 1
+        self.unsaved += 1
+        if self.call_later is not None:
+            if self.sync_timer is None:
+                self.sync_timer = self.call_later(self.sync_interval, self.sync)
+        elif self.unsynced >= self.sync_every or time() - self.last_sync >= self.sync_interval:
+            self.sync()
+        return number
+#
+    def sync(self):
+        """fsync the records appended so far, saving the index now and then."""
+        self.sync_timer = None
+        if self.unsynced:
+            os.fsync(self.fd)
+            self.unsynced = 0
+        self.last_sync = time()
+        if self.unsaved >= INDEX_SAVE_EVERY:
+            self.save_index()
+#
+    def close(self):
+        if self.sync_timer is not None:
+            self.sync_timer.cancel()
+        self.sync()
+        if self.unsaved:
+            self.save_index()
+        self.release_map()
+        os.close(self.fd)
+#
+    def data(self):
+        """Read-only mmap of the whole journal, remapped when records have been added."""
+        if self.map is None or self.mapped != self.count:
+            self.release_map()
+            self.map = mmap.mmap(self.fd, len(JOURNAL_MAGIC) + self.count * RECORD.size,
+                                 access=mmap.ACCESS_READ)
+            self.mapped = self.count
+        return self.map
+#
+    def release_map(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:                 # A records() array still uses it, it closes when that goes
+                pass
+            self.map = None
+#
+    def timestamp(self, number):
+        return struct.unpack_from("<d", self.data(), len(JOURNAL_MAGIC) + number * RECORD.size)[0]
+#
+    def record(self, number):
+        if not 0 <= number < self.count:
+            raise IndexError("record {} is not in the journal".format(number))
+        timestamp, method, yang, moving, spare, crc = RECORD.unpack_from(
+            self.data(), len(JOURNAL_MAGIC) + number * RECORD.size)
+        return JournalRecord(timestamp, JOURNAL_METHODS[method], Casting(yang, moving))
+#
+    def records(self):
+        """Every record as a NumPy structured array over the mmap, nothing is copied."""
+        np = need_numpy()
+        dtype = np.dtype([('timestamp', '<f8'), ('method', 'u1'), ('yang', 'u1'),
+                          ('moving', 'u1'), ('spare', 'u1'), ('crc', '<u4')])
+        return np.frombuffer(self.data(), dtype=dtype, count=self.count, offset=len(JOURNAL_MAGIC))
+#
+    def check(self):
+        """Check every record's CRC, returns the numbers of the bad ones."""
+        data = self.data()
+        return [number for number in range(self.count)
+                if not record_valid(data, len(JOURNAL_MAGIC) + number * RECORD.size)]
+#
+#   Indexes
+#
+    def add_to_index(self, number, timestamp, yang):
+        self.by_number[KING_WEN[yang]].append(number)
+        day = date.fromtimestamp(timestamp).toordinal()
+        if day not in self.by_day:
+            self.by_day[day] = array('I')
+            self.days = None
+        self.by_day[day].append(number)
+#
+    def index_records(self, start, end):
+        data = self.data()
+        for number in range(start, end):
+            timestamp, method, yang, moving, spare, crc = RECORD.unpack_from(
+                data, len(JOURNAL_MAGIC) + number * RECORD.size)
+            self.add_to_index(number, timestamp, yang)
+#
+    def load_index(self):
+        """Read the saved index, returns how many records it covers (0 if it is missing or stale)."""
+        try:
+            with open(self.index_path, "rb") as index_file:
+                data = index_file.read()
+            magic, indexed, day_count, last_crc = INDEX_HEADER.unpack_from(data, 0)
+            if magic != INDEX_MAGIC or indexed > self.count:
+                return 0
+            if indexed and last_crc != struct.unpack_from(
+                    "<I", self.data(), len(JOURNAL_MAGIC) + indexed * RECORD.size - 4)[0]:
+                return 0                        # Journal has been replaced since the index was saved
+            offset = INDEX_HEADER.size
+            lengths = array('I', data[offset:offset + 4 * HEXAGRAM_COUNT])
+            offset += 4 * HEXAGRAM_COUNT
+            by_number = [array('I')]
+            for length in lengths:
+                by_number.append(array('I', data[offset:offset + 4 * length]))
+                offset += 4 * length
+            days = array('I', data[offset:offset + 8 * day_count])
+            offset += 8 * day_count
+            by_day = {}
+            for day, length in zip(days[0::2], days[1::2]):
+                by_day[day] = array('I', data[offset:offset + 4 * length])
+                offset += 4 * length
+            if offset != len(data):
+                return 0
+        except (OSError, struct.error, ValueError):
+            return 0
+        self.by_number, self.by_day, self.days = by_number, by_day, None
+        return indexed
+#
+    def save_index(self):
+        """Write the index beside the journal, replacing the old one in a single rename."""
+        last_crc = 0
+        if self.count:
+            last_crc = struct.unpack_from("<I", self.data(), len(JOURNAL_MAGIC) + self.count * RECORD.size - 4)[0]
+        days = sorted(self.by_day)
+        parts = [INDEX_HEADER.pack(INDEX_MAGIC, self.count, len(days), last_crc),
+                 array('I', [len(numbers) for numbers in self.by_number[1:]]).tobytes()]
+        parts += [numbers.tobytes() for numbers in self.by_number[1:]]
+        parts.append(array('I', [value for day in days for value in (day, len(self.by_day[day]))]).tobytes())
+        parts += [self.by_day[day].tobytes() for day in days]
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as index_file:
+            index_file.write(b"".join(parts))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temp_path, self.index_path)
+        self.unsaved = 0
+#
+#   Queries
+#
+    def find(self, number=None, first_day=None, last_day=None):
+        """Record numbers of castings of hexagram number (any if None) between two dates, inclusive."""
+        if first_day is None and last_day is None:
+            if number is None:
+                return range(self.count)
+            return self.by_number[number]
+        if self.days is None:
+            self.days = sorted(self.by_day)
+        first = bisect_left(self.days, first_day.toordinal()) if first_day else 0
+        last = bisect_right(self.days, last_day.toordinal()) if last_day else len(self.days)
+        in_range = [self.by_day[day] for day in self.days[first:last]]
+        if not in_range:
+            return []
+        if number is None:
+            return sorted(record for numbers in in_range for record in numbers)
+        low = min(numbers[0] for numbers in in_range)
+        high = max(numbers[-1] for numbers in in_range)
+        candidates = self.by_number[number]
+        days = set(self.days[first:last])
+        return [record for record in candidates[bisect_left(candidates, low):bisect_right(candidates, high)]
+                if date.fromtimestamp(self.timestamp(record)).toordinal() in days]
+#
+    def castings(self, number=None, first_day=None, last_day=None):
+        return [self.record(record) for record in self.find(number, first_day, last_day)]
+
+
+def benchmark(path, count):
+    from ichingcast import Caster, CAST_METHODS
+    caster = Caster(1)
+    journal = Journal(path)
+    start = perf_counter()
+    now = time()
+    for index in range(count):                  # Spread over a year, most recent last
+        method = CAST_METHODS[index % len(CAST_METHODS)]
+        journal.append(caster.cast(method), method, now - (count - index) * 365 * 86400.0 / count)
+    elapsed = perf_counter() - start
+    print("Appended {:,} castings at {:,.0f}/s, journal holds {:,}".format(count, count / elapsed, len(journal)))
+    journal.close()
+    start = perf_counter()
+    journal = Journal(path)
+    print("Reopened in {:.1f} ms".format((perf_counter() - start) * 1000))
+    this_year = date.today().year
+    start = perf_counter()
+    found = journal.castings(54, date(this_year, 1, 1), date(this_year, 12, 31))
+    print("{:,} castings of 54 this year found in {:.1f} ms".format(
+        len(found), (perf_counter() - start) * 1000))
+    start = perf_counter()
+    found = journal.find(None, date.today(), date.today())
+    print("{:,} castings today found in {:.1f} ms".format(len(found), (perf_counter() - start) * 1000))
+    journal.close()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:]]
+    if len(args) >= 2 and args[0] == "show":
+        journal = Journal(args[1])
+        number = int(args[2]) if len(args) > 2 else None
+        year = int(args[3]) if len(args) > 3 else None
+        first_day, last_day = (date(year, 1, 1), date(year, 12, 31)) if year else (None, None)
+        for record in journal.castings(number, first_day, last_day):
+            print("{:%Y-%m-%d %H:%M:%S} {:7} {:2} {}".format(
+                datetime.fromtimestamp(record.timestamp), record.method,
+                record.casting.primary.number, record.casting.primary.name))
+        journal.close()
+    elif len(args) >= 2 and args[0] == "check":
+        if os.path.exists(args[1] + INDEX_SUFFIX):
+            os.remove(args[1] + INDEX_SUFFIX)   # Rebuilt from the records as the journal opens
+        journal = Journal(args[1])
+        bad = journal.check()
+        journal.save_index()
+        print("{} records, {} bad".format(len(journal), len(bad)))
+        journal.close()
+        sys.exit(1 if bad else 0)
+    elif len(args) >= 2 and args[0] == "benchmark":
+        benchmark(args[1], int(args[2]) if len(args) > 2 else 100000)
+    else:
+        print("usage: ichingjournal.py show|check|benchmark FILE [number [year] | count]")
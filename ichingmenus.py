@@ -1,216 +1,312 @@
 #!/usr/bin/env python3
-# requires `pifacecad` to be installed
+# requires `pifacecad` to be installed, or run with `simulate` to use the in-memory simulator
 #
 # Initialisation and Menu Setup Routine based on radio.py from examples and sysinfo.py Service
 #
 
-from time import sleep
+from time import monotonic
+STARTED = monotonic()                   # Start of the --profile-startup timings
+from collections import namedtuple
+from functools import partial
+import queue
 import os
 import sys
-import signal
-import shlex
-import math
-import lirc
+import textwrap
+import threading
 
 PY3 = sys.version_info[0] >= 3
 if not PY3:
     print("I Ching only works with `python3`.")
     sys.exit(1)
 
-from threading import Barrier  # must be using Python 3
-import subprocess
-import pifacecommon
-import pifacecad
-from pifacecad.lcd import LCD_WIDTH
+from ichingbackend import load_backend
+from ichingdisplay import DDRAM_WIDTH, FrameBuffer, FrameCache, LCDWriter
+from ichingscheduler import FrameScheduler
+from ichinghexagrams import Casting, HEXAGRAM_COUNT
+from ichingcast import Caster
+from ichinggame import Game
+from ichinginput import IR_DEBOUNCE, InputFilter
+from ichingsettings import Settings
+from ichingtrace import instrument_lcd, trace_callback, traced, tracer
 
-CHECK_INTERVAL = 1          # 1 second debugging delay for checking for menu actions the screen
 TOGGLE_INTERVAL = 1         # 1 second toggle delay between symbols and words
 STEP_INTERVAL = 0.5         # 0.5 second delay between Character display shifts
-PAUSE_INTERVAL = 2          # 2 seconds debugging delay to capture what happened before return from interrupts
+NOTICE_INTERVAL = 2         # 2 seconds showing a notice before the menu returns
 CONFIRM_DELAY = 5           # 5 seconds to confirm exit request.
-GET_IP_CMD = "hostname --all-ip-addresses"
-STOP_SYSINFO_CMD = "service pifacecadsysinfo stop"
+SPLASH_TEXT = ("I Ching Hexagrams", " Press a Button")
+MARQUEE_DELAY = 3           # 3 seconds showing a cast hexagram before its text starts to scroll
+MARQUEE_HOLD = 1.5          # 1.5 seconds at each end of a scrolling page
+SCROLL_STEPS = {"Slow": 0.5, "Normal": 0.3, "Fast": 0.15}   # Delay between display shifts of scrolling text, by scroll_speed
+BACKLIGHT_TIMEOUTS = {"Never": None, "30 s": 30, "1 min": 60, "5 min": 300}  # Idle seconds before the backlight goes off
+BACKEND = "simulator" if "simulate" in sys.argv else os.environ.get("ICHING_BACKEND", "pifacecad")
+SIMULATE_SCRIPT = [                     # (delay, source, code) button presses for `simulate`
+    (1.0, 'switch', 5),                 # Leave the splash screen
+    (0.5, 'switch', 5),                 # Leave the help screen
+    (0.5, 'switch', 5),                 # Select Cast
+    (0.5, 'switch', 5),                 # Cast with Stalks
+    (2.0, 'switch', 4),                 # Back to the main menu
+    (0.5, 'ir', 3),                     # Move to Quit with the remote
+    (0.5, 'switch', 5),                 # Select Quit
+    (0.5, 'switch', 5),                 # Confirm
+]
+JOURNAL_FILE = os.environ.get("ICHING_JOURNAL",        # Every casting is recorded here
+                              "" if BACKEND == "simulator" else os.path.expanduser("~/iching.journal"))
+SETTINGS_FILE = os.environ.get("ICHING_SETTINGS",      # Settings are kept here between runs
+                               "" if BACKEND == "simulator" else os.path.expanduser("~/iching.settings"))
+
+backend = load_backend(BACKEND)         # PiFaceCAD board or the simulator
+LCD_WIDTH = backend.LCD_WIDTH
 
 #
-#   Set up bitmap variables for I Ching symbols
+#   Set up bitmap variables for I Ching symbols.  CGRAM slots are handed out by the frame
+#   buffer's glyph cache when a screen first uses a bitmap.
 #
-i_tl_symbol = pifacecad.LCDBitmap(
+i_tl_symbol = backend.LCDBitmap(
     [0x10, 0x1f, 0x11, 0x15, 0x15, 0x15, 0x11, 0x1f])
-i_bl_symbol = pifacecad.LCDBitmap(
+i_bl_symbol = backend.LCDBitmap(
     [0x11, 0x15, 0x15, 0x15, 0x11, 0x1f, 0x10, 0x10])
-i_tr_symbol = pifacecad.LCDBitmap(
+i_tr_symbol = backend.LCDBitmap(
     [0x01, 0x1f, 0x11, 0x15, 0x15, 0x15, 0x11, 0x1f])
-i_br_symbol = pifacecad.LCDBitmap(
+i_br_symbol = backend.LCDBitmap(
     [0x11, 0x15, 0x15, 0x15, 0x11, 0x1f, 0x01, 0x01])
-i_tl_symbol_index, i_tr_symbol_index, i_bl_symbol_index, i_br_symbol_index = 0, 1, 2, 3
-ching_tl_symbol = pifacecad.LCDBitmap(
+ching_tl_symbol = backend.LCDBitmap(
     [0x0, 0x0, 0x0, 0x3, 0x6, 0xc, 0x10, 0x3])
-ching_bl_symbol = pifacecad.LCDBitmap(
+ching_bl_symbol = backend.LCDBitmap(
     [0x6, 0xc, 0x10, 0x3, 0x6, 0xc, 0x10, 0x0])
-ching_tr_symbol = pifacecad.LCDBitmap(
+ching_tr_symbol = backend.LCDBitmap(
     [0x0, 0x10, 0x18, 0x14, 0x12, 0x12, 0x11, 0x11])
-ching_br_symbol = pifacecad.LCDBitmap(
+ching_br_symbol = backend.LCDBitmap(
     [0x11, 0x13, 0x12, 0x14, 0x14, 0x18, 0x010, 0x0])
-ching_tl_symbol_index, ching_tr_symbol_index, ching_bl_symbol_index, ching_br_symbol_index = 4, 5, 6, 7
-
-# 5x8 Custom Bitmap hEXAGRAM construction values
-
-blank_space_bits = 0b00000          # Top and bottom lines of 5x8 display will always be blank
-old_yang_bits = 0b10101             # Short-form of '--0--' to fit LCD limitations = 21 Decimal
-young_yang_bits = 0b11111           # Short-form of '-----' to fit LCD limitations = 31 Decimal
-old_yin_bits = 0b10001              # Short-form of '--X--' to fit LCD limitations = 17 Decimal
-young_yin_bits = 0b11011            # Short-form of '-- --' to fit LCD limitations = 27 Decimal
-
-# Custom Bitmap indices - NOTE - re-uses splash screen locations as only 8 custom bitmaps supported by
-# PiFaceCAD module.
-
-hexagram_index = 0
-
-def run_cmd(cmd):
-    return subprocess.check_output(cmd, shell=True).decode('utf-8')
 
-
-def splash_loop():                      # Display startup splash screens until a button is pressed.
-    global menus
-    global display_lcd
-    display_lcd.splash = True           # Another splash follows this one, so disable menu generation.
-    display_toggle = True               # Start with the words.
+def next_event(session):                # Run due animation frames and timers until an event arrives
+    while True:
+        try:
+            return session.menus.events.get(timeout=session.scheduler.timeout())
+        except queue.Empty:
+            session.scheduler.run_due()
+
+
+def run_pending(session):               # Handle every queued event and due timer without blocking
+    while True:
+        try:
+            event = session.menus.events.get_nowait()
+        except queue.Empty:
+            break
+        if not handle_event(session, event):
+            return False
+    session.scheduler.run_due()
+    return True
+
+
+def splash_frames(session):             # Splash screen animation, yields the delay before each next step
+    display_lcd = session.display_lcd
+    while True:
+        display_lcd.show(*SPLASH_TEXT)
+        yield TOGGLE_INTERVAL
+        display_lcd.show(               # alternate with I Ching symbols moving across the screen
+            [i_tl_symbol, i_tr_symbol, ching_tl_symbol, ching_tr_symbol],
+            [i_bl_symbol, i_br_symbol, ching_bl_symbol, ching_br_symbol])
+        yield STEP_INTERVAL             # Animation delay
+        for i in range(12):
+            display_lcd.writer.submit('move_right')
+            yield STEP_INTERVAL         # Animation delay
+        for i in range(12):
+            display_lcd.writer.submit('move_left')
+            yield STEP_INTERVAL         # Animation delay
+        yield TOGGLE_INTERVAL           # Wait for a button press before repeating.
+
+
+#
+#   Scrolling text.  A text is word wrapped to 40 column display RAM lines and shown a page of
+#   two lines at a time, one on each row.  The controller's display shift moves both rows
+#   together, so a page scrolls left as one until its longer line has been seen.
+#
+
+def marquee_pages(text):                # Pages of two display RAM rows and the shifts to see all of each
+    pages = MARQUEE_PAGES.get(text)
+    if pages is None:
+        lines = textwrap.wrap(text, DDRAM_WIDTH) or [""]
+        pages = MARQUEE_PAGES[text] = tuple(
+            (tuple(lines[index:index + 2]), max(len(line) for line in lines[index:index + 2]) - LCD_WIDTH)
+            for index in range(0, len(lines), 2))
+    return pages
+
+
+MARQUEE_PAGES = {}                      # Word wrapped pages by text, each text is only wrapped once
+
+
+def marquee_frames(session, texts):     # Scroll each text with the display shift, then show the last screen again
+    display_lcd = session.display_lcd
+    scroll_step = SCROLL_STEPS[session.settings['scroll_speed']]
+    yield MARQUEE_DELAY
+    for text in texts:
+        for rows, steps in marquee_pages(text):
+            display_lcd.writer.submit('render_page', rows)
+            yield MARQUEE_HOLD
+            for step in range(steps):
+                display_lcd.writer.submit('scroll', rows)   # Ignored once anything else is drawn
+                yield scroll_step
+            if steps > 0:
+                yield MARQUEE_HOLD
+    display_lcd.show(display_lcd.topline, display_lcd.botline)
+
+
+def backlight_frames(session):          # Turn the backlight off once no button has been pressed for the set time
+    while True:
+        timeout = BACKLIGHT_TIMEOUTS[session.settings['backlight']]
+        if timeout is None:
+            return                      # apply_settings() starts this again if the setting changes
+        idle = monotonic() - session.input_filter.last_press
+        if idle >= timeout:
+            session.dim_display()
+            yield timeout               # A press lights it again, none can dim it sooner than this
+        else:
+            yield timeout - idle
+
+
+def splash_loop(session):               # Display startup splash screens until a button is pressed.
+    menus = session.menus
+    session.display_lcd.splash = True           # Another splash follows this one, so disable menu generation.
     menus.active = False                # Flag still processing startup screens
     menus.waiting = True                # Flag waiting for button press
-    while menus.waiting:                # If no button was pressed Update Display Splash Screen
-        if display_toggle:
-            cad.lcd.clear()
-            cad.lcd.write("I Ching Hexagrams")
-            cad.lcd.set_cursor(1,1)
-            cad.lcd.write("Press a Button")
-            display_toggle = False
-        else:                           # alternate with I Ching symbols moving across the screen
-            cad.lcd.clear()
-            cad.lcd.set_cursor(0,0)
-            cad.lcd.write_custom_bitmap(i_tl_symbol_index)
-            cad.lcd.write_custom_bitmap(i_tr_symbol_index)
-            cad.lcd.write_custom_bitmap(ching_tl_symbol_index)
-            cad.lcd.write_custom_bitmap(ching_tr_symbol_index)
-            cad.lcd.set_cursor(0,1)
-            cad.lcd.write_custom_bitmap(i_bl_symbol_index)
-            cad.lcd.write_custom_bitmap(i_br_symbol_index)
-            cad.lcd.write_custom_bitmap(ching_bl_symbol_index)
-            cad.lcd.write_custom_bitmap(ching_br_symbol_index)
-            sleep(STEP_INTERVAL)        # Animation delay
-            for i in range(12):         # Proceed with animation if no buttom was pressed
-                if menus.waiting == False: break
-                cad.lcd.move_right()
-                sleep(STEP_INTERVAL)    # Animation delay
-            for i in range(12):         # Proceed with animation if no buttom was pressed
-                if menus.waiting == False: break
-                cad.lcd.move_left()
-                sleep(STEP_INTERVAL)    # Animation delay
-            display_toggle = True
-        sleep(TOGGLE_INTERVAL)          # Wait for a button press before repeating.
-
-
-def help_splash():                      # Display Help splash screen.
-    global menus
-    global display_lcd
+    animation = session.scheduler.animate(splash_frames(session))
+    while menus.waiting:                # Animate until a callback posts the button press
+        next_event(session)
+    animation.cancel()                  # Stop the animation straight away
+
+
+def help_splash(session):               # Display Help splash screen.
+    menus = session.menus
     menus.waiting = True                # Flag waiting for button press
     menus.active = False                # Flag still processing startup screens
-    display_lcd.splash = False          # No splash follows this, so allow menu generation.
+    session.display_lcd.splash = False  # No splash follows this, so allow menu generation.
 #
 #   Set up display of Help screen
 #
-    display_lcd.topline = "Key:  IR  <^>"
-    display_lcd.botline = "1 2 3 4  Back"
-#
-#   Display Help Screen
-#
-    cad.lcd.clear()
-    cad.lcd.set_cursor(1,0)
-    cad.lcd.write(display_lcd.topline)
-    cad.lcd.set_cursor(1,1)
-    cad.lcd.write(display_lcd.botline)
-    while menus.waiting:                # Wait until a button is pressed
-        sleep(PAUSE_INTERVAL)
-
-
-def main_loop():
-    global menus
-    global display_lcd
-    global hexagrams
-    menus.active = True                                 # Flag program is running normally
-    while menus.active:
-        if menus.paused:
-#
-#   If paused is True, we are partway through a menu change, so process Menu Selection
-#
-            sleep(PAUSE_INTERVAL)                       # Debugging wait before updating the display
-            if menus.menu_level == 1:                   # Process Level 1 Menu
-                menus.menu_level = 2                    # Will be at Level 2 when finished.
-                if menus.selected_action == -1:         # Switch '-1' = 'No action Required'.
-                    cad.lcd.clear()                     # Send debug message to show that we got here
-                    cad.lcd.set_cursor(0,0)
-                    cad.lcd.write("Debugging Trap")
-                    cad.lcd.set_cursor(0,1)
-                    cad.lcd.write("Please Wait...")
-                    sleep(CHECK_INTERVAL)               # Wait for it to be seen
-                    menus.begin_menu()                  # Redisplay MAIN_MENU Option 0
-                elif menus.selected_action == 0:        # Switch 0  = 'Cast' selected
-                    menus.current_menu_index = 0
-                    menus.active_menu = CAST_MENU
-                    menus.update_display()
-                    menus.selected_action = -1          # prevent further background processing
-                elif menus.selected_action == 1:        # Switch 1 = 'Game' selected
-                    menus.current_menu_index = 0
-                    menus.active_menu = GAME_MENU
-                    menus.update_display()
-                    menus.selected_action = -1          # prevent further background processing
-                elif menus.selected_action == 2:        # Switch 2 = 'Settings' selected
-                    menus.current_menu_index = 0
-                    menus.active_menu = OPTION_MENU
-                    menus.update_display()
-                    menus.selected_action = -1          # prevent further background processing
-                elif menus.selected_action == 3:        # Switch 3 = 'Quit' selected
-                    cad.lcd.clear()
-                    cad.lcd.set_cursor(0,0)
-                    cad.lcd.write("Quit? Select = Y")   # Ask for confirmation
-                    cad.lcd.set_cursor(8,1)
-                    cad.lcd.write("Back = N")
-                    menus.exit_pending = True           # tell switch handlers Quit is pending
-                    sleep(CONFIRM_DELAY)                # wait for the user to confirm or back out
-                    if menus.exit_pending:              # If user does not confirm, time out and continue
-                        menus.exit_pending = False
-                        cad.lcd.clear()
-                        cad.lcd.set_cursor(3,0)
-                        cad.lcd.write("Timed Out.")
-                        cad.lcd.set_cursor(2,1)
-                        cad.lcd.write("Quit Aborted.")
-                        sleep(PAUSE_INTERVAL)
-                        menus.begin_menu()              # Restart with MAIN_MENU Option 0
-                        menus.selected_action = -1      # prevent further background processing
-                    else:                               # User has decided.
-                        if menus.no_quit:               # Quit aborted, back to waiting
-                            menus.begin_menu()          # set up MAIN_MENU Option 0
-                        else:
-                            menus.active = False        # Disable Interrupt processing
-                            break                       # Exit loop.
-                else:                                   # Trap exceptions
-                    cad.lcd.clear()
-                    cad.lcd.set_cursor(1,0)
-                    cad.lcd.write("Unknown Option")
-                    cad.lcd.set_cursor(1,1)
-                    cad.lcd.write("Press Back...")
-#
-# Level 2 menus have no code to access yet, so display hidden parameters for now.
-#
-            else:                                       # Display hidden paramters of selected menu option
-                cad.lcd.clear()
-                cad.lcd.set_cursor(0,0)
-                local_page = menus.current_item['page']
-                local_option = menus.current_item['position']
-                local_message = "Page " + str(local_page) + " Option " + str(local_option)
-                cad.lcd.write(local_message)
-                cad.lcd.set_cursor(1,1)
-                cad.lcd.write("Press Back...")
-            menus.paused = False                        # Clear interrupt in progress flag.
+    session.display_lcd.show(" Key:  IR  <^>", " 1 2 3 4  Back")
+    while menus.waiting:                # Block until a callback posts the button press
+        next_event(session)
+
+
+def quit_timed_out(session):            # User did not answer the Quit prompt in time, so continue
+    menus = session.menus
+    if menus.exit_pending:              # A reply may have been posted just now, if so that wins
+        menus.exit_pending = False
+        session.display_lcd.show("   Timed Out.", "  Quit Aborted.")
+        menus.selected_action = -1      # prevent further background processing
+        session.scheduler.call_later(NOTICE_INTERVAL, menus.begin_menu)  # Restart with MAIN_MENU Option 0
+
+
+def main_loop(session):
+    session.menus.active = True                         # Flag program is running normally
+    while session.menus.active:
+        if not handle_event(session, next_event(session)):  # Block until a switch or IR callback posts an event
+            break
+
+
+def handle_event(session, event):                       # Process one event, returns False once Quit is confirmed
+    menus = session.menus
+    if event.kind == 'reply':                       # User has answered the Quit prompt.
+        menus.quit_timer.cancel()
+        if menus.no_quit:                           # Quit aborted, back to waiting
+            menus.begin_menu()                      # set up MAIN_MENU Option 0
+        else:
+            menus.active = False                    # Disable Interrupt processing
+            return False                            # Exit loop.
+        return True
+    if event.kind == 'press':                       # A button's callback, run here so only this thread draws
+        menus.stop_marquee()                        # Any press stops scrolling text first
+        event.value()
+        return True
+    if event.kind == 'navigate':                    # Next and Previous presses since the last screen
+        menus.stop_marquee()
+        session.input_filter.steps()
+        session.display_lcd.when_drawn(partial(menus.latency.record, event))
+        return True
+    if event.kind != 'select':                      # Only selections need background processing
+        return True
+    if menus.menu_level == 3:                       # Select answers or moves on in a game
+        session.game.select()
+    else:
+        item = menus.current_item
+        MENU_ACTIONS.get((item.page, item.position), show_option)(session, item)    # One lookup, no if/elif ladder
+    session.display_lcd.when_drawn(partial(menus.latency.record, event))   # Time it once it is on screen
+    if not menus.exit_pending:                      # The Quit prompt stays paused until a reply or the time out
+        menus.paused = False                        # Clear interrupt in progress flag.
+    return True
+
+
+#
+#   Menu actions, one per 'command' in the menu structures below.  Each is called with the
+#   session and the selected MenuItem when Select is pressed.
+#
+
+def open_menu(session, item):           # Move down to the menu page named by the item's transition
+    menus = session.menus
+    menus.current_menu_index = CAST_POSITIONS.get(menus.cast_method, 0) if item.new_menu == CAST_PAGE else 0
+    menus.menu_level = 2                # Will be at Level 2 when finished.
+    menus.active_menu = MENU_PAGES[item.new_menu]
+    menus.update_display()
+    menus.selected_action = -1          # prevent further background processing
+
+
+def ask_quit(session, item):            # Ask for confirmation, confirm() and back() post the reply
+    session.display_lcd.show("Quit? Select = Y", "        Back = N")
+    session.menus.exit_pending = True   # tell switch handlers Quit is pending
+    session.menus.quit_timer = session.scheduler.call_later(CONFIRM_DELAY, quit_timed_out, session)
+
+
+def cast_lines(session, item):          # Cast with the selected method and show the result
+    hexagrams = session.hexagrams
+    session.settings.set('cast_method', item.name)  # Written to the settings file a while later
+    session.menus.cast_method = item.name
+    hexagrams.cast(session.menus.cast_method)
+    hexagrams.display_lines
+    session.menus.start_marquee(hexagrams.reading())
+
+
+def show_option(session, item):         # Display hidden paramters of a menu option with no code yet
+    session.display_lcd.show(item.option_line, " Press Back...")
+
+
+def show_stats(session, item):          # Number of castings and the most cast hexagram
+    from ichingstats import journal_summary
+    if session.hexagrams.journal is None:
+        session.display_lcd.show("No journal open", " Press Back...")
+    else:
+        session.display_lcd.show(*journal_summary(session.hexagrams.journal))
+
+
+def play_game(session, item):           # Start a round of the game mode named by the item
+    session.menus.menu_level = 3        # Game screens until Back
+    session.game.start(item.name)
+
+
+def show_sysinfo(session, item):        # Address, load and temperature, read in process and cached
+    from ichingsysinfo import get_system_info
+    session.display_lcd.show(*get_system_info().screen(LCD_WIDTH))
+
+
+def change_setting(session, item):      # Show the item's setting, each further Select steps it on
+    menus = session.menus
+    if menus.editing == item.setting:
+        session.settings.cycle(item.setting)
+        session.apply_settings()
+    menus.editing = item.setting        # Until the menu moves
+    value = session.settings[item.setting]
+    session.display_lcd.show_frame(('setting', item.setting, value), setting_screen, item, value)
+
+
+MENU_COMMANDS = {
+    'open': open_menu,
+    'game': play_game,
+    'quit': ask_quit,
+    'cast': cast_lines,
+    'show': show_option,
+    'stats': show_stats,
+    'sysinfo': show_sysinfo,
+    'setting': change_setting,
+}
 
 
 # Menu Structures
@@ -220,21 +316,25 @@ MAIN_MENU = [
      'page': 0,
      'position': 0,
      'action': "Cast Hexagram",
+     'command': 'open',
      'new_menu': 1},
     {'name': "Game",
      'page': 0,
      'position': 1,
      'action': "Play Game",
+     'command': 'open',
      'new_menu': 2},
     {'name': "Settings",
      'page': 0,
      'position': 2,
      'action': "Change Settings",
+     'command': 'open',
      'new_menu': 3},
     {'name': "Quit",
      'page': 0,
      'position': 3,
      'action': "Quit Program",
+     'command': 'quit',
      'new_menu': -1},
 ]
 
@@ -243,21 +343,25 @@ CAST_MENU = [
      'page': 1,
      'position': 0,
      'action': "Use Stalks",
+     'command': 'cast',
      'new_menu': 0},
     {'name': "Coins",
      'page': 1,
      'position': 1,
      'action': "Use Coins",
+     'command': 'cast',
      'new_menu': 0},
     {'name': "Dice",
      'page': 1,
      'position': 2,
      'action': "Use Dice",
+     'command': 'cast',
      'new_menu': 0},
     {'name': "User",
      'page': 1,
      'position': 3,
      'action': "User Data",
+     'command': 'show',
      'new_menu': 0},
 ]
 
@@ -266,21 +370,25 @@ GAME_MENU = [
      'page': 2,
      'position': 0,
      'action': "Solve Lines",
+     'command': 'game',
      'new_menu': 0},
     {'name': "Trigrams",
      'page': 2,
      'position': 1,
      'action': "Solve Trigrams",
+     'command': 'game',
      'new_menu': 0},
     {'name': "Hexagram",
      'page': 2,
      'position': 2,
      'action': "Solve Hexagram",
+     'command': 'game',
      'new_menu': 0},
     {'name': "Full",
      'page': 2,
      'position': 3,
      'action': "Solve All Steps",
+     'command': 'game',
      'new_menu': 0},
 ]
 
@@ -289,96 +397,231 @@ OPTION_MENU = [
      'page': 3,
      'position': 0,
      'action': "Display Help",
+     'command': 'show',
      'new_menu': 0},
     {'name': "Controls",
      'page': 3,
      'position': 1,
-     'action': "Select Controls",
+     'action': "Button Layout",
+     'command': 'setting',
+     'setting': 'navigation',
      'new_menu': 0},
     {'name': "Display",
      'page': 3,
      'position': 2,
-     'action': "Select Display",
+     'action': "System Info",
+     'command': 'sysinfo',
      'new_menu': 0},
     {'name': "Sounds",
      'page': 3,
      'position': 3,
      'action': "Select Sounds",
+     'command': 'show',
+     'new_menu': 0},
+    {'name': "Stats",
+     'page': 3,
+     'position': 4,
+     'action': "Casting Stats",
+     'command': 'stats',
+     'new_menu': 0},
+    {'name': "Scroll",
+     'page': 3,
+     'position': 5,
+     'action': "Scroll Speed",
+     'command': 'setting',
+     'setting': 'scroll_speed',
+     'new_menu': 0},
+    {'name': "Backlight",
+     'page': 3,
+     'position': 6,
+     'action': "Light Timeout",
+     'command': 'setting',
+     'setting': 'backlight',
      'new_menu': 0},
 ]
 
-HEXAGRAM_LIST = [
-    {'name': "Fu",
-     'meaning': "Change (Turning Point)",
-     'number': 24,
-     'judgement': "Return, Success. going and coming without error. Action brings good fortune",
-     'line_1': "Quick return. No remorse. Great good fortune",
-     'line_2': "Quiet return. Good fortune.",
-     'line_3': "Repeated Return. Danger. No blame.",
-     'line_4': "Walking with others, return alone.",
-     'line_5': "Noble hearted return. No remorse.",
-     'line_6': "Missed chance. Return not possible.",
-     'static': ""},
-    {'name': "Kuei Mei",
-     'meaning': "The Marrying Maiden",
-     'number': 54,
-     'judgement': "Ill-considered action brings misfortune",
-     'line_1': "Acting within your limitations brings good fortune",
-     'line_2': "Remain loyal in disappointment.",
-     'line_3': "Taking shelter in obligation.",
-     'line_4': "Biding timne brings a fruitful union.",
-     'line_5': "Accepting marriage below your station bears fruit.",
-     'line_6': "Keeping up appearances benefits no-one.",
-     'static': "To act now is folly"},
-]
+#
+#   Compile the menu structures once: each page becomes a tuple of MenuItems carrying the
+#   lines they display, so moving through a menu only looks them up.  'new_menu' is the page
+#   an 'open' command moves to, page 0 is the top level (Level 1) menu.  'setting' is the
+#   ichingsettings name a 'setting' command changes.
+#
+
+MenuItem = namedtuple('MenuItem', ['name', 'page', 'position', 'action', 'command', 'new_menu',
+                                   'topline', 'botline', 'option_line', 'setting'])
+
+
+def compile_menu(menu):
+    level = 1 if menu[0]['page'] == 0 else 2
+    return tuple(MenuItem(
+        item['name'], item['page'], item['position'], item['action'], item['command'], item['new_menu'],
+        str(level) + "." + str(item['position'] + 1) + " " + item['name'],
+        " " + item['action'].ljust(LCD_WIDTH-1),
+        "Page " + str(item['page']) + " Option " + str(item['position']),
+        item.get('setting')) for item in menu)
+
+
+def compile_actions(pages):             # (page, position) -> action function
+    return dict(((item.page, item.position), MENU_COMMANDS[item.command]) for page in pages for item in page)
+
+
+MENU_PAGES = tuple(compile_menu(menu) for menu in (MAIN_MENU, CAST_MENU, GAME_MENU, OPTION_MENU))
+MAIN_MENU, CAST_MENU, GAME_MENU, OPTION_MENU = MENU_PAGES
+MENU_ACTIONS = compile_actions(MENU_PAGES)
+CAST_PAGE = CAST_MENU[0].page
+CAST_POSITIONS = dict((item.name, item.position) for item in CAST_MENU)    # The Cast menu opens at the saved method
+
+
+def menu_screen(item):
+    return item.topline, item.botline
+
+
+def setting_screen(item, value):        # A setting's menu action over its current value
+    return item.action, " > " + value
+
+
+def hexagram_screen(casting):           # Hexagram number and lines glyph over its name
+    hexagram_image = backend.LCDBitmap(casting.lcd_rows())
+    message = "Hexagram " + str(casting.primary.number) + " "
+    return [message, hexagram_image], " " + casting.primary.name
+
+
+def fill_screens(screens):              # Build the menu and hexagram screens ahead of use
+    screens.fill((('menu', item.page, item.position), menu_screen(item))
+                 for page in MENU_PAGES for item in page)
+    screens.fill((('hexagram', mask, 0), hexagram_screen(Casting(mask, 0)))
+                 for mask in range(HEXAGRAM_COUNT))     # Castings with moving lines, and texts, are built on first use
+
 
 class Hexagrams(object):
-    def __init__(self, cad, start_item=0):
+    def __init__(self, session, start_item=0):
 #
-# Working values for testing
+# Working values for testing - Kuei Mei with moving lines 2 and 4, bottom line first
 #
-        self.lines = [blank_space_bits, young_yin_bits, young_yin_bits, old_yang_bits, young_yin_bits,
-            old_yang_bits, young_yang_bits, blank_space_bits]
-        self.hexagram_number = 54
+        self.casting = Casting.from_values((7, 9, 8, 9, 8, 8))
+        self.caster = Caster()
+        self.journal = None                     # ichingjournal.Journal once opened
+        self.opener = None                      # Thread opening the journal
+
 #
-# link to PiFaceCAD library
+# link to the session's display
 #
-        self.cad = cad
+        self.session = session
 #
     @property
-    def display_lines(self):                  # Construct 'Old' Hexagram for storing as a bitmap
-        hexagram_image = pifacecad.LCDBitmap(self.lines)
+    def lines(self):                          # LCD bitmap rows, derived from the casting's masks
+        return self.casting.lcd_rows()
 #
-# Store the 'Old' Hexagram in Custome Store 0)
+    @property
+    def mask(self):                           # 6 bit line mask, bit 0 = bottom line (LCD row 6)
+        return self.casting.yang
 #
-        self.cad.lcd.store_custom_bitmap(hexagram_index,hexagram_image)
+    @property
+    def hexagram_number(self):                # King Wen number of the current lines
+        return self.casting.primary.number
 #
-# Clear LCD and display Old Hexagram
+    @property
+    @traced("hexagrams.display_lines")
+    def display_lines(self):                  # Display 'Old' Hexagram with its lines as a custom bitmap
+#
+# The screen cache builds each casting's screen once, the glyph cache only uploads the bitmap
+# if it is not already resident
+#
+        casting = self.casting
+        self.session.display_lcd.show_frame(('hexagram', casting.yang, casting.moving), hexagram_screen, casting)
+#
+    def text(self, field):                    # Judgement or line text of the current hexagram, if known
+        from ichingtext import get_hexagram_text     # Mapped when a text is first shown
+        return get_hexagram_text().text(self.hexagram_number, field)
+#
+    def reading(self):                        # Judgement and the changing lines' texts, or the static text
+        lines = ['line_' + str(line) for line in self.casting.changing_lines] or ['static']
+        return [text for text in [self.text(field) for field in ['judgement'] + lines] if text]
+#
+    def cast(self, method):                   # Cast new lines with one of the CAST_METHODS
+        self.casting = self.caster.cast(method)
+        if self.journal is not None:
+            self.journal.append(self.casting, method)
+#
+    def open_journal(self, path, profile=None):
+        """Open the journal on a background thread, after a power loss it rebuilds its index first."""
+        def run():
+            from ichingjournal import Journal   # Opened after the first splash frame is drawn
+            start = monotonic()
+            try:
+                journal = Journal(path, call_later=self.session.scheduler.call_later)  # fsyncs between frames
+            except (OSError, ValueError) as error:
+                print("Could not open the casting journal, castings will not be recorded: {}".format(error))
+                return
+            finally:
+                if profile is not None:
+                    profile.add("journal (background)", start, monotonic())
+            self.journal = journal              # Castings made until now are not recorded
+        self.opener = threading.Thread(target=run, name="JournalOpener", daemon=True)
+        self.opener.start()
+#
+    def close_journal(self):
+        if self.opener is not None:
+            self.opener.join()                  # Finish opening before closing it
+            self.opener = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+#
+# Process Changing Lines - Old Yang becomes Young Yin and Old Yin becomes Young Yang
 #
-        self.cad.lcd.clear()
-        message = "Hexagram " #+ str(self.hexagram_number) + " "
-        self.cad.lcd.write(message)
-        self.cad.lcd.write_custom_bitmap(hexagram_index)
+    def transform(self):
+        self.casting = self.casting.transformed()
+
+
+MenuEvent = namedtuple('MenuEvent', ['kind', 'value', 'posted'])
+
+
+class LatencyMonitor(object):
+    """Records the time from a button press to the matching screen update."""
+    def __init__(self):
+        self.samples = []
 #
-# Process Changing Lines - Old Yang becomes Young Yin and Old Yin becomes Young Yan
+    def record(self, event):
+        self.samples.append(monotonic() - event.posted)
 #
-    def transform(self):
-        for itemID in range(len(self.lines)):
-            if self.lines[itemID] == old_yang_bits:
-                self.lines[itemID] = young_yin_bits
-            if self.lines[itemID] == old_yin_bits:
-                self.lines[itemID] = young_yang_bits
+    def report(self):
+        if not self.samples:
+            return "Latency: no button presses recorded"
+        ordered = sorted(self.samples)
+        median = ordered[len(ordered) // 2]
+        return "Latency: {} presses, min {:.2f} ms, median {:.2f} ms, max {:.2f} ms".format(
+            len(ordered), ordered[0] * 1000, median * 1000, ordered[-1] * 1000)
 
 
 class DisplayLCD(object):
-    def __init__(self, cad, start_item=0):
+    def __init__(self, cad, start_item=0, threaded=True):
         self.splash = True
         self.topline = ""
         self.botline = ""
-        
+        self.frame = FrameBuffer(cad.lcd, LCD_WIDTH)    # Shadow copy of what is on the LCD
+        self.screens = FrameCache(LCD_WIDTH)            # Finished screens, filled by fill_screens()
+        self.writer = LCDWriter(self.frame)             # Only the writer thread touches the LCD
+        if threaded:
+            self.writer.start()
+#
+    def show(self, topline, botline):
+        """Make topline and botline the current screen, sending only the changes."""
+        self.topline = topline
+        self.botline = botline
+        self.writer.submit('render', (self.topline, self.botline))
+#
+    def show_frame(self, key, build, *args):
+        """Show the cached screen for key, build(*args) gives its two lines on a miss."""
+        self.show(*self.screens.get(key, build, *args))
+#
+    def when_drawn(self, function):
+        """Run function on the writer thread once the screens queued so far are drawn."""
+        self.writer.call(function)
+
 
 class Menus(object):
-    def __init__(self, cad, start_item=0):
+    def __init__(self, session, start_item=0):
         self.current_menu_index = start_item
         self.menu_level = 1                     # Top level menu
         self.selected_action = -1               # '-1' identifies no Active selection exists.
@@ -390,22 +633,55 @@ class Menus(object):
         self.exit_pending = False               # Denotes that the User has selected the 'Quit' option
         self.paused = False                     # Stops re-entrant code whilst handling interrupts
         self.go_home = True                     # Forces a return to the default top level menu.
-        self.cad = cad
+        self.events = queue.Queue()             # Button presses posted by the listener callbacks
+        self.latency = LatencyMonitor()         # Press-to-screen timings for the main loop
+        self.quit_timer = None                  # Scheduled time out of the Quit prompt
+        self.marquee = None                     # Scrolling hexagram text, stopped by any button press
+        self.editing = None                     # Setting shown by the last Select, the next one changes it
+        self.session = session
+        self.display_lcd = session.display_lcd
 #
     @property
     def current_item(self):
         """Returns the current Menu Item."""
         return self.active_menu[self.current_menu_index]
+#
+    def post(self, kind, value=None):
+        """Hand an event from a listener callback to the main loop."""
+        self.events.put(MenuEvent(kind, value, monotonic()))
+#
+    def deliver(self, callback, event):
+        """Run a press's callback, through the main loop once it is running.
+
+        Scrolling text is drawn and stopped on the main loop, so a callback run on a listener
+        thread could land between a marquee step being picked up and drawn.
+        """
+        if self.active:
+            self.post('press', partial(callback, event))
+        else:
+            callback(event)                         # Splash screens wait in next_event(), they handle no events
+#
+    def wake(self):
+        self.waiting = False                        # Flag button has been pressed
+        self.begin_menu()                           # Display opening menu.
+        self.post('wake')                           # Release the splash screen waiting for this press
+#
+    def start_marquee(self, texts):
+        self.stop_marquee()
+        if texts:
+            self.marquee = self.session.scheduler.animate(marquee_frames(self.session, texts))
+#
+    def stop_marquee(self):                         # Main loop only, like the marquee's own steps
+        if self.marquee is not None and not self.marquee.done:
+            self.marquee.cancel()
+            self.display_lcd.show(self.display_lcd.topline, self.display_lcd.botline)  # Back to the screen under the text
+        self.marquee = None
 #
     def disabled(self):
-        self.cad.lcd.clear()
-        self.cad.lcd.set_cursor(1,0)
-        self.cad.lcd.write("Button Disabled.")
-        self.cad.lcd.set_cursor(2,1)
-        self.cad.lcd.write("Press Another.")
+        self.display_lcd.show(" Button Disabled.", "  Press Another.")
 #
     def begin_menu(self):
-        if not display_lcd.splash:                  # No splash screen following, so set up the menus.
+        if not self.display_lcd.splash:             # No splash screen following, so set up the menus.
             self.go_home = True                     # Flag restart initiated
             self.current_menu_index = 0             # set up MAIN_MENU Option 0
             self.menu_level = 1
@@ -415,9 +691,10 @@ class Menus(object):
 #        
     def change_menu(self, new_menu_index):
         if self.waiting:                            # Is Splash screen waiting for button press?
-            self.waiting = False                    # Yes, flag button has been pressed
-            self.begin_menu()                       # Display opening menu.
-    
+            self.wake()                             # Yes, flag button has been pressed
+
+        elif self.active and not self.paused and self.menu_level == 3:
+            self.session.game.choose(new_menu_index)    # Item switches choose a game answer
         elif self.active and not self.paused:       # Else if no pending menu update change menu selection
             """Change the Menu Item."""
             self.current_menu_index = new_menu_index % len(self.active_menu)
@@ -425,187 +702,286 @@ class Menus(object):
 #
     def confirm(self, event=None):
         if self.waiting:                            # Is Splash screen waiting for button press?
-            self.waiting = False                    # Yes, flag button has been pressed
-            self.begin_menu()                       # Display opening Menu
+            self.wake()                             # Yes, flag button has been pressed
 #
 #   Check if Quit has been requested prior to this invocation.
 #
         elif self.exit_pending:                     # If we are here, User has confirmed exit
             self.paused = True                      # Set button press interrupt handling in progress Flag
             self.no_quit = False                    # Tell background routine exit confirmed
-            self.cad.lcd.clear()                    # Display quitting message
-            self.cad.lcd.set_cursor(4,0)
-            self.cad.lcd.write("Quitting.")
-            self.cad.lcd.set_cursor(1,1)
-            self.cad.lcd.write("Please Wait...")
+            self.display_lcd.show("    Quitting.", " Please Wait...")    # Display quitting message
             self.exit_pending = False               # Flag exit request processing complete
+            self.post('reply')                      # Wake the main loop waiting on the Quit prompt
 #
 #   identify Selection Made
 #
         elif self.active and not self.paused:       # Otherwise process default 'Select' action
             self.paused = True                      # Set button press interrupt handling in progress Flag
-            self.cad.lcd.clear()                    # Display debugging message
-            self.cad.lcd.set_cursor(1,0)
-            option_action = self.current_item['action']
-            self.cad.lcd.write(option_action)
-            self.cad.lcd.set_cursor(1,1)
-            self.cad.lcd.write("Selected.")         # End of Debugging message
                                                     # Remember the selection for later.
             self.selected_action = self.current_menu_index
+            self.post('select', self.selected_action)   # Main loop renders the result straight away
 #            self.current_menu_index = 0
 #
     def back(self, event=None):
         if self.waiting:                            # Is Splash screen waiting for button press?
-            self.waiting = False                    # Yes, flag button has been pressed
-            self.begin_menu()                       # Display opening Menu
+            self.wake()                             # Yes, flag button has been pressed
 #
 #   Check if Quit has been requested prior to this invocation.
 #
         elif self.exit_pending:                     # If we are here, User has confirmed continue
             self.paused = True                      # Set button press interrupt handling in progress Flag
             self.no_quit = True                     # Tell main routine exit aborted
-            self.cad.lcd.clear()                    # Display Aborting message
-            self.cad.lcd.set_cursor(3,0)
-            self.cad.lcd.write("Continuing.")
-            self.cad.lcd.set_cursor(1,1)
-            self.cad.lcd.write("Please Wait...")
+            self.display_lcd.show("   Continuing.", " Please Wait...")   # Display Aborting message
             self.exit_pending = False               # Flag exit request processing complete.
+            self.post('reply')                      # Wake the main loop waiting on the Quit prompt
         elif self.active and not self.paused:       # Otherwise process default 'Back' button actions
             self.paused = True                      # Set button press interrupt handling in progress Flag
-            if self.menu_level == 2:                # should be 1 or 2, anything other than 2 is treated as a 1.
+            if self.menu_level == 3:                # Leave the game for its menu
+                self.menu_level = 2
+                self.update_display()
+                self.paused = False
+            elif self.menu_level == 2:              # should be 1, 2 or 3, anything else is treated as a 1.
                 self.selected_action = -1           # Clear Active Selection
                 self.begin_menu()                   # Display opening Menu
             else:                                   # Send Button Inactive message.
                 self.disabled()
-#
-    def next_item(self, event=None):
-        if self.waiting:                        # Is Splash screen waiting for button press?
-            self.waiting = False                # Yes, flag button has been pressed
-            self.begin_menu()                   # Display opening Menu
-#
-#   Otherwise if the program running with no menu update or quit request pending,
-#   process default 'Next' button actions
-#
-        elif self.active and not self.paused and not self.exit_pending:     
-            self.change_menu(self.current_menu_index + 1)
-#
-    def previous_item(self, event=None):
-        if self.waiting:                        # Is Splash screen waiting for button press?
-            self.waiting = False                # Yes, flag button has been pressed
-            self.begin_menu()                   # Display opening Menu
-#
-#   Otherwise if the program running with no menu update or quit request pending,
-#   process default 'Previous' button actions
-#
-        elif self.active and not self.paused and not self.exit_pending:
-            self.change_menu(self.current_menu_index - 1)
-#
+                self.paused = False                 # Nothing else follows, so the menus take presses again
+#
+    def move(self, steps):
+        """Move steps items through the active menu, False if it can not move now."""
+        if self.active and not self.paused and not self.exit_pending:
+            if self.menu_level == 3:
+                self.session.game.move(steps)
+            else:
+                self.change_menu(self.current_menu_index + steps)
+            return True
+        return False
+#
+    @traced("menus.update_display")
     def update_display(self):
-        self.cad.lcd.clear()
         self.update_menu()
         # self.update_playing()
         # self.update_volume()
 #
     def update_menu(self):                      # Display options
         """Updates the menu status."""
-        display_lcd.botline = self.current_item['action'].ljust(LCD_WIDTH-1)
-        display_lcd.topline = str(self.menu_level) + "."
-        display_lcd.topline = display_lcd.topline + str(self.current_menu_index + 1) + " "
-        display_lcd.topline = display_lcd.topline + self.current_item['name']
-        self.cad.lcd.set_cursor(0, 0)
-        self.cad.lcd.write(display_lcd.topline)
-        self.cad.lcd.set_cursor(1, 1)
-        self.cad.lcd.write(display_lcd.botline)
+        item = self.current_item                # Screens are built when the menus are compiled
+        self.editing = None                     # Moving on leaves a setting as it is
+        self.display_lcd.show_frame(('menu', item.page, item.position), menu_screen, item)
 #
     def close(self):
 #       Stop attribute only works when running as a service.: disable for now
 #       self.stop()     
-        self.cad.lcd.clear()
-        self.cad.lcd.backlight_off()
-
-
-def menu_select_switch(event):
-    global menus
-    menus.change_menu(event.pin_num)
+        self.display_lcd.writer.submit('clear')
+        self.display_lcd.writer.submit('backlight_off')
+        self.display_lcd.writer.stop()              # Draw what is left, then release the LCD
+#
+    def select_switch(self, event):
+        self.change_menu(event.pin_num)
+#
+    def select_ir(self, event):
+        self.change_menu(int(event.ir_code))
 
 
-def menu_select_ir(event):
-    global menus
-    menus.change_menu(int(event.ir_code))
+class Session(object):
+    """One console: its display, timers, menus and casting state, so several can share a process."""
+    def __init__(self, cad, threaded=True, clock=monotonic, settings_file=""):
+        self.cad = cad
+        instrument_lcd(cad.lcd)                 # Times every LCD call when ICHING_TRACE is set
+        self.display_lcd = DisplayLCD(cad, threaded=threaded)
+        self.scheduler = FrameScheduler()       # Animation frames and time outs for the session's main loop
+        self.settings = Settings(settings_file, self.scheduler.call_later)     # One read, written behind
+        for problem in self.settings.problems:
+            print("Settings: " + problem)
+        self.menus = Menus(self)
+        self.hexagrams = Hexagrams(self)
+        self.input_filter = InputFilter(self.menus, clock)     # Debounces the presses for the menus
+        self.input_filter.on_press = self.wake_display
+        self.game = Game(self.display_lcd.show, self.display_lcd.frame.width, self.scheduler.call_later)
+        self.lit = True                         # Backlight state, changed under light_lock
+        self.light_lock = threading.Lock()      # Presses light it on listener threads, the time out dims it
+        self.backlight = None                   # Backlight time out, while one is set
+        self.apply_settings()
+#
+    def apply_settings(self):                   # Make the settings take effect, after loading or a change
+        self.menus.cast_method = self.settings['cast_method']
+        self.input_filter.swapped = self.settings['navigation'] == "Swapped"
+        if self.backlight is not None:
+            self.backlight.cancel()
+        self.backlight = self.scheduler.animate(backlight_frames(self))
+#
+    def wake_display(self):                     # Any press lights the backlight again
+        with self.light_lock:
+            if not self.lit:
+                self.lit = True
+                self.display_lcd.writer.submit('backlight_on')
+#
+    def dim_display(self):
+        with self.light_lock:
+            if self.lit:
+                self.lit = False
+                self.display_lcd.writer.submit('backlight_off')
+#
+    def close(self):
+        self.settings.close()                   # Write any change still waiting
+        self.hexagrams.close_journal()
+        self.menus.close()
+
+
+def register_listeners(session):        # Connect the switches and remote to the menu callbacks
+    switchlistener = register_switches(session)
+    irlistener, irlistener_activated = register_ir(session)
+    return switchlistener, irlistener, irlistener_activated
+
+
+def register_switches(session):
+    # wait for button presses.  Callbacks only post events, so the main thread can
+    # deactivate the listeners itself once the main loop has finished.
+    menus = session.menus
+    keys = session.input_filter
+    switchlistener = backend.SwitchEventListener(chip=session.cad)
+    callbacks = [keys.press("switch {}".format(menuid), menus.select_switch) for menuid in range(4)]
+    callbacks += [keys.press("switch 4", menus.back), keys.press("switch 5", menus.confirm),
+                  keys.step("switch 6", -1), keys.step("switch 7", 1)]
+    for pin, callback in enumerate(callbacks):
+        switchlistener.register(pin, backend.IODIR_ON, trace_callback("callback.switch {}".format(pin), callback))
+    switchlistener.activate()
+    return switchlistener
 
 
-if __name__ == "__main__":
-    cad = pifacecad.PiFaceCAD()
-    global menus
-    menus = Menus(cad)
-    hexagrams = Hexagrams(cad)
-    display_lcd = DisplayLCD(cad)
-    cad.lcd.blink_off()
-    cad.lcd.cursor_off()
-#
-    # listener cannot deactivate itself so we have to wait until it has
-    # finished using a barrier.
-    global end_barrier
-    end_barrier = Barrier(2)
-#
-    # wait for button presses
-    switchlistener = pifacecad.SwitchEventListener(chip=cad)
-    for menuid in range(4):
-        switchlistener.register(
-           menuid, pifacecad.IODIR_ON, menu_select_switch)
-    switchlistener.register(4, pifacecad.IODIR_ON, menus.back)
-    switchlistener.register(5, pifacecad.IODIR_ON, menus.confirm)
-    switchlistener.register(6, pifacecad.IODIR_ON, menus.previous_item)
-    switchlistener.register(7, pifacecad.IODIR_ON, menus.next_item)
-#
-    irlistener = pifacecad.IREventListener(
+def register_ir(session):               # Returns the IR listener and whether it could be activated
+    irlistener = backend.IREventListener(
         prog="i-ching-hexagrams",
-        lircrc="/usr/share/doc/scifipi-i-ching/ichinglircrc")
+        lircrc="/usr/share/doc/scifipi-i-ching/ichinglircrc",
+        chip=session.cad)
     for i in range(4):
-        irlistener.register(str(i), menu_select_ir)
-#
-    switchlistener.activate()
+        irlistener.register(str(i), trace_callback("callback.ir {}".format(i), session.input_filter.press(
+            "ir {}".format(i), session.menus.select_ir, IR_DEBOUNCE, repeats=True)))     # LIRC repeats held buttons
     try:
         irlistener.activate()
-    except lirc.InitError:
+    except backend.IRInitError:
         print("Could not initialise IR, running without IR controls.")
-        irlistener_activated = False
-    else:
-        irlistener_activated = True
+        return irlistener, False
+    return irlistener, True
+
+
+class IRStarter(threading.Thread):
+    """Sets up the IR listener in the background, LIRC can stall for a while before failing."""
+    def __init__(self, session, profile):
+        threading.Thread.__init__(self, name="IRStarter", daemon=True)
+        self.session = session
+        self.profile = profile
+        self.irlistener = None
+        self.activated = False
+#
+    def run(self):
+        with self.profile.phase("IR listener (background)"):
+            self.irlistener, self.activated = register_ir(self.session)
+#
+    def deactivate(self):
+        self.join()                             # Finish starting before stopping it
+        if self.activated:
+            self.irlistener.deactivate()
+
+
+class StartupProfile(object):
+    """Per phase startup timings for --profile-startup, measured from when the program started."""
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.phases = []                        # (name, start, end) seconds after started
+        self.lock = threading.Lock()
+#
+    def phase(self, name):
+        return StartupPhase(self, name)
+#
+    def add(self, name, start, end):
+        with self.lock:
+            self.phases.append((name, start - self.started, end - self.started))
+#
+    def report(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        lines = ["Startup phases, ms:   took    done at"]
+        for name, start, end in phases:
+            lines.append("  {:26} {:7.1f} {:10.1f}".format(name, (end - start) * 1000, end * 1000))
+        return "\n".join(lines)
+
+
+class StartupPhase(object):
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+#
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+#
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, self.start, monotonic())
+
+
+if __name__ == "__main__":
+#
+#   Draw the first splash frame as soon as the board is up, then set up everything else.
+#   The IR listener starts in the background and the cached screens are built between
+#   splash animation frames.  Custom bitmaps are only uploaded when a screen first uses them.
+#
+    profile = StartupProfile()
+    profile.add("imports", STARTED, monotonic())
+    with profile.phase("board"):
+        cad = backend.PiFaceCAD()
+        session = Session(cad, settings_file=SETTINGS_FILE)
+        display_lcd = session.display_lcd
+        display_lcd.writer.submit('blink_off')
+        display_lcd.writer.submit('cursor_off')
+    if "clear" not in sys.argv:
+        with profile.phase("first splash frame"):
+            display_lcd.writer.submit('backlight_on')
+            display_lcd.show(*SPLASH_TEXT)
+            display_lcd.writer.flush()          # Time it on the glass, not just queued
+    with profile.phase("switch listener"):
+        switchlistener = register_switches(session)
+    ir_starter = IRStarter(session, profile)
+    ir_starter.start()
+    if backend.name == "pifacecad" and "clear" not in sys.argv:
+        from ichingsysinfo import stop_service
+        stop_service()                  # The sysinfo service would draw over the menus
 #
     if "clear" in sys.argv:
-        cad.lcd.clear()
-        cad.lcd.display_off()
-        cad.lcd.backlight_off()
+        display_lcd.writer.submit('clear')
+        display_lcd.writer.submit('display_off')
+        display_lcd.writer.submit('backlight_off')
     else:
-        #
-        #   Store bitmaps for I Ching characters for use later
-        #
-        cad.lcd.store_custom_bitmap(i_tl_symbol_index,i_tl_symbol)
-        cad.lcd.store_custom_bitmap(i_tr_symbol_index,i_tr_symbol)
-        cad.lcd.store_custom_bitmap(i_bl_symbol_index,i_bl_symbol)
-        cad.lcd.store_custom_bitmap(i_br_symbol_index,i_br_symbol)
-        cad.lcd.store_custom_bitmap(ching_tl_symbol_index,ching_tl_symbol)
-        cad.lcd.store_custom_bitmap(ching_tr_symbol_index,ching_tr_symbol)
-        cad.lcd.store_custom_bitmap(ching_bl_symbol_index,ching_bl_symbol)
-        cad.lcd.store_custom_bitmap(ching_br_symbol_index,ching_br_symbol)
-        cad.lcd.backlight_on()
-        splash_loop()	                # display splash screen until a button is pressed.
-        help_splash()                   # Display help on what the buttons are called.
-        main_loop()		                # run Main Loop until pressing the 'Back' button clears the menus.active flag.
-        sleep(PAUSE_INTERVAL)           # debugging delay.
-        cad.lcd.clear()
-        cad.lcd.write("Program Stopped")
+        def fill_screens_later():
+            with profile.phase("screen cache (deferred)"):
+                fill_screens(display_lcd.screens)
+            if JOURNAL_FILE:
+                session.hexagrams.open_journal(JOURNAL_FILE, profile)
+        session.scheduler.call_later(0, fill_screens_later)
+        if tracer is not None:
+            session.scheduler.animate(tracer.write_frames())
+        if "simulate" in sys.argv:
+            cad.play(SIMULATE_SCRIPT)   # Press the simulated buttons
+        splash_loop(session)            # display splash screen until a button is pressed.
+        help_splash(session)            # Display help on what the buttons are called.
+        main_loop(session)              # run Main Loop until pressing the 'Back' button clears the menus.active flag.
+        if "latency" in sys.argv:
+            display_lcd.writer.flush()
+            print(session.menus.latency.report())
+            print(session.input_filter.report())
+            print(display_lcd.writer.stats())
+        display_lcd.show("Program Stopped", "")
 #
 #   Disable Interrup processing
 #
-        switchlistener.deactivate()
-        if irlistener_activated:
-            irlistener.deactivate()
-    end_barrier.wait()                  # wait for interrupt handlers to stop, then exit
+    switchlistener.deactivate()
+    ir_starter.deactivate()
+    if "--profile-startup" in sys.argv:
+        print(profile.report())
 #
     # exit
-    menus.close()
-#    switchlistener.deactivate()
-#    if irlistener_activated:
-#        irlistener.deactivate()
+    session.close()
+    if "simulate" in sys.argv:
+        print(display_lcd.frame.stats())
+        print(display_lcd.screens.stats())
+        print(cad.lcd.stats())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# Frame scheduler for the I Ching Hexagrams PiFaceCAD program.
+#
+# Timed work (animation frames, time outs) is kept on a heap of monotonic deadlines.  The
+# main loop blocks on its event queue for at most timeout() seconds and then calls
+# run_due(), so a button press is handled the moment it arrives and can cancel anything
+# still scheduled.
+#
+# An animation is a generator: each step draws a frame and yields the delay in seconds
+# before its next step.
+#
+
+import heapq
+from itertools import count
+from time import monotonic
+
+
+class Task(object):
+    """A scheduled callback or animation, cancel() stops it before its next step."""
+    __slots__ = ('function', 'args', 'generator', 'cancelled')
+#
+    def __init__(self, function=None, args=(), generator=None):
+        self.function = function
+        self.args = args
+        self.generator = generator
+        self.cancelled = False
+#
+    def cancel(self):
+        self.cancelled = True
+#
+    @property
+    def done(self):
+        return self.cancelled or (self.function is None and self.generator is None)
+
+
+class FrameScheduler(object):
+    """Runs callbacks and generator animations when their deadlines fall due."""
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.heap = []                          # (deadline, sequence, task)
+        self.sequence = count()                 # Keeps equal deadlines in order
+#
+    def call_later(self, delay, function, *args):
+        task = Task(function, args)
+        self.push(delay, task)
+        return task
+#
+    def animate(self, generator):
+        """Run the first step of generator now, later steps after the delays it yields."""
+        task = Task(generator=generator)
+        self.push(0, task)
+        return task
+#
+    def push(self, delay, task):
+        heapq.heappush(self.heap, (self.clock() + delay, next(self.sequence), task))
+#
+    def timeout(self):
+        """Seconds until the next deadline, None if nothing is scheduled."""
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)            # Cancelled tasks are dropped lazily
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - self.clock(), 0)
+#
+    def run_due(self):
+        now = self.clock()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, sequence, task = heapq.heappop(self.heap)
+            if task.cancelled:
+                continue
+            if task.generator is None:
+                function, task.function = task.function, None
+                function(*task.args)
+                continue
+            try:
+                delay = next(task.generator)
+            except StopIteration:
+                task.generator = None
+                continue
+            deadline += delay
+            if deadline < now:                  # Fell behind, carry on from now rather than catch up
+                deadline = now + delay
+            if not task.cancelled:
+                heapq.heappush(self.heap, (deadline, next(self.sequence), task))
+#
+    def cancel_all(self):
+        for deadline, sequence, task in self.heap:
+            task.cancel()
+        self.heap = []
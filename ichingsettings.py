@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Settings for the I Ching Hexagrams PiFaceCAD program, kept in memory and written behind.
+#
+# Every setting is listed in SCHEMA with its default and the choices it may take, which is
+# also the order Select steps through them on the Settings menu.  The settings file is read
+# once, with a single read, when a Session starts; anything missing or not in SCHEMA falls
+# back to its default.  A change is only written WRITE_DELAY seconds after the last one, so
+# stepping through choices costs one write to the SD card, and the write happens on one writer
+# thread through a temporary file, fsync and rename, so a power cut leaves the old file or
+# the new one and the menus never wait for the card.  close() waits for the writer and writes
+# anything it has not, so no change is lost when the program stops.  A write that fails is
+# reported and leaves the changes unsaved, for the next save or close() to try again.
+#
+#   python3 ichingsettings.py show [file]    - print the settings and any problems
+#   python3 ichingsettings.py benchmark      - time a change against writing it straight away
+#
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from time import perf_counter
+
+from ichingcast import CAST_METHODS
+
+WRITE_DELAY = 5.0           # 5 seconds after the last change before it is written
+
+Setting = namedtuple('Setting', ['name', 'default', 'choices'])
+
+SCHEMA = (
+    Setting('cast_method', "Stalks", tuple(CAST_METHODS)),
+    Setting('navigation', "Normal", ("Normal", "Swapped")),         # Swapped: switch 6 is Next, 7 Previous
+    Setting('scroll_speed', "Normal", ("Slow", "Normal", "Fast")),
+    Setting('backlight', "Never", ("Never", "30 s", "1 min", "5 min")),     # Idle time before it goes off
+)
+SETTINGS = dict((setting.name, setting) for setting in SCHEMA)
+
+
+def defaults():
+    return dict((setting.name, setting.default) for setting in SCHEMA)
+
+
+def validate(values):
+    """Settings from values, returns (settings, problems) with defaults for anything invalid."""
+    settings = defaults()
+    problems = []
+    if not isinstance(values, dict):
+        return settings, ["settings are not a JSON object, using the defaults"]
+    for name, value in values.items():
+        if name not in SETTINGS:
+            problems.append("unknown setting {!r} ignored".format(name))
+        elif value not in SETTINGS[name].choices:
+            problems.append("{} cannot be {!r}, using {!r}".format(name, value, SETTINGS[name].default))
+        else:
+            settings[name] = value
+    return settings, problems
+
+
+class Settings(object):
+    """SCHEMA values in memory, written to path a while after they last changed.
+
+    call_later(delay, function) schedules the write, the session's scheduler in the program.
+    With no path nothing is read or written.
+    """
+    def __init__(self, path="", call_later=None, delay=WRITE_DELAY):
+        self.path = path
+        self.call_later = call_later
+        self.delay = delay
+        self.values = defaults()
+        self.problems = []
+        self.pending = None                     # Scheduled write of the changes
+        self.lock = threading.Lock()            # One write at a time, of the values as they are then
+        self.unsaved = False                    # Changed since the values last written
+        self.wanted = threading.Event()         # Wakes the writer thread
+        self.writer = None                      # Writer thread, started by the first save
+        self.closed = False
+        self.writes = 0
+        self.failures = 0
+        if path:
+            self.load()
+#
+    def load(self):
+        try:
+            with open(self.path, "rb") as source:
+                data = source.read()            # The whole file in one read
+        except FileNotFoundError:
+            return
+        try:
+            values = json.loads(data.decode('utf-8'))
+        except ValueError as error:
+            self.problems = ["{} is not valid JSON, using the defaults: {}".format(self.path, error)]
+            return
+        self.values, self.problems = validate(values)
+#
+    def __getitem__(self, name):
+        return self.values[name]
+#
+    def set(self, name, value):
+        if name not in SETTINGS:
+            raise KeyError(name)
+        if value not in SETTINGS[name].choices:
+            raise ValueError("{} cannot be {!r}".format(name, value))
+        if self.values[name] != value:
+            self.values[name] = value
+            self.unsaved = True
+            self.write_later()
+#
+    def cycle(self, name):
+        """Step name on to its next choice, returns the new value."""
+        choices = SETTINGS[name].choices
+        self.set(name, choices[(choices.index(self.values[name]) + 1) % len(choices)])
+        return self.values[name]
+#
+    def write_later(self):                      # Start the delay again, so a run of changes is one write
+        if not self.path:
+            return
+        if self.pending is not None:
+            self.pending.cancel()
+        if self.call_later is None:
+            self.save()
+        else:
+            self.pending = self.call_later(self.delay, self.save)
+#
+    def save(self):
+        """Have the writer thread write the settings."""
+        self.pending = None
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_loop, name="SettingsWriter", daemon=True)
+            self.writer.start()
+        self.wanted.set()
+#
+    def write_loop(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if self.closed:
+                return
+            self.try_write()
+#
+    def try_write(self):                        # write(), reporting a failure rather than raising it
+        try:
+            self.write()
+        except OSError as error:
+            self.failures += 1
+            print("Could not write the settings to {}: {}".format(self.path, error))
+#
+    def write(self):
+        with self.lock:
+            values = dict(self.values)
+            text = json.dumps(values, indent=1, sort_keys=True)
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as output:
+                output.write(text)
+                output.flush()
+                os.fsync(output.fileno())
+            os.replace(temporary, self.path)
+            self.unsaved = self.values != values    # Unless changed again while writing
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)             # Make the rename itself survive a power cut
+            finally:
+                os.close(directory)
+            self.writes += 1
+#
+    def close(self):
+        """Finish any write under way and write any change still waiting, before the program stops."""
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        if self.writer is not None:
+            self.closed = True
+            self.wanted.set()
+            self.writer.join()
+            self.writer = None
+        if self.unsaved and self.path:
+            self.try_write()
+
+
+def benchmark(count=1000):
+    from ichingscheduler import FrameScheduler
+    path = os.path.join(tempfile.gettempdir(), "iching.settings.bench")
+    direct = Settings(path)
+    start = perf_counter()
+    for index in range(20):
+        direct.write()
+    written = (perf_counter() - start) / 20
+    scheduler = FrameScheduler()
+    settings = Settings(path, scheduler.call_later)
+    start = perf_counter()
+    for index in range(count):
+        settings.cycle('scroll_speed')
+    changed = (perf_counter() - start) / count
+    settings.close()
+    loaded = perf_counter()
+    Settings(path)
+    loaded = perf_counter() - loaded
+    print("write with fsync and rename {:.3f} ms".format(written * 1000))
+    print("change in memory {:.2f} us, {} changes written {} time(s)".format(
+        changed * 1e6, count, settings.writes))
+    print("load {:.3f} ms".format(loaded * 1000))
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "show":
+        settings = Settings(sys.argv[2] if len(sys.argv) > 2 else os.path.expanduser("~/iching.settings"))
+        for setting in SCHEMA:
+            print("{:13} {:8} of {}".format(setting.name, settings[setting.name], ", ".join(setting.choices)))
+        for problem in settings.problems:
+            print("Problem: " + problem)
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    else:
+        print("usage: ichingsettings.py show [file] | benchmark")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Monte Carlo check of the casting methods, spread over every core.
+#
+# Each worker process casts chunks of hexagrams with ichingcast.cast_batch() from its own
+# random stream (SeedSequence.spawn, so the streams are independent and repeatable), counts
+# each chunk into a local 64x64 yang by relating mask histogram, and adds that into one
+# histogram in multiprocessing.shared_memory under a lock.  Only a (castings, seconds)
+# pair per worker goes back through pickling.
+#
+# The histogram is checked against the odds promised by ichingcast.line_probabilities()
+# with the chi-square tests in ichingstats.
+#
+#   python3 ichingsim.py [method] [count] [--workers N]  - simulate count castings
+#   python3 ichingsim.py scaling [method] [count]         - the same with 1, 2, 4 ... workers
+#
+
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+from time import perf_counter
+
+from ichingcast import CAST_METHODS, cast_batch
+from ichinghexagrams import HEXAGRAM_COUNT, need_numpy
+from ichingjournal import JOURNAL_METHODS
+from ichingstats import METHOD_COUNT, SIGNIFICANCE, method_checks, stats_from_joint
+
+CHUNK = 1 << 20                                 # Castings per cast_batch() call in a worker
+DEFAULT_COUNT = 100000000
+CELLS = HEXAGRAM_COUNT * HEXAGRAM_COUNT
+
+worker_memory = None                            # The shared histogram, in each worker process
+worker_histogram = None
+worker_lock = None
+
+
+def attach(name, lock):                         # Pool initializer, maps the shared histogram
+    global worker_histogram, worker_lock, worker_memory
+    np = need_numpy()
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_histogram = np.ndarray((CELLS,), dtype=np.int64, buffer=worker_memory.buf)
+    worker_lock = lock
+
+
+def simulate_shard(method, count, seed):
+    """Cast count hexagrams into the shared histogram, returns (count, seconds)."""
+    np = need_numpy()
+    start = perf_counter()
+    generator = np.random.Generator(np.random.PCG64(seed))
+    done = 0
+    while done < count:
+        size = min(CHUNK, count - done)
+        yang, moving = cast_batch(method, size, generator)
+        keys = yang.astype(np.intp) << 6
+        keys |= yang ^ moving
+        local = np.bincount(keys, minlength=CELLS)
+        with worker_lock:                       # One locked add per chunk, not per casting
+            np.add(worker_histogram, local, out=worker_histogram)
+        done += size
+    return count, perf_counter() - start
+
+
+def simulate(method, count, workers, seed=None):
+    """Run count castings of method over workers processes.
+
+    Returns (histogram, seconds, shards) where histogram[yang, relating] is a 64x64
+    count array and shards holds each worker's (castings, seconds).
+    """
+    np = need_numpy()
+    if method not in CAST_METHODS:
+        raise ValueError("{!r} is not a casting method".format(method))
+    streams = np.random.SeedSequence(seed).spawn(workers)
+    counts = [count // workers + (1 if index < count % workers else 0) for index in range(workers)]
+    memory = shared_memory.SharedMemory(create=True, size=CELLS * 8)
+    try:
+        histogram = np.ndarray((CELLS,), dtype=np.int64, buffer=memory.buf)
+        histogram[:] = 0
+        lock = multiprocessing.Lock()
+        start = perf_counter()
+        with multiprocessing.Pool(workers, initializer=attach, initargs=(memory.name, lock)) as pool:
+            shards = pool.starmap(simulate_shard, [(method, shard, stream)
+                                                   for shard, stream in zip(counts, streams)])
+        elapsed = perf_counter() - start
+        result = histogram.reshape(HEXAGRAM_COUNT, HEXAGRAM_COUNT).copy()
+        del histogram
+    finally:
+        memory.close()
+        memory.unlink()
+    return result, elapsed, shards
+
+
+def checks(method, histogram):
+    """Chi-square checks of a yang by relating histogram against the method's odds."""
+    np = need_numpy()
+    joint = np.zeros((METHOD_COUNT, HEXAGRAM_COUNT, HEXAGRAM_COUNT), dtype=np.int64)
+    yang, relating = np.meshgrid(np.arange(HEXAGRAM_COUNT), np.arange(HEXAGRAM_COUNT), indexing='ij')
+    joint[JOURNAL_METHODS.index(method), yang, yang ^ relating] = histogram
+    return method_checks(stats_from_joint(joint))
+
+
+def print_run(method, count, workers, seed=None):
+    histogram, elapsed, shards = simulate(method, count, workers, seed)
+    rate = count / elapsed
+    busy = sum(seconds for castings, seconds in shards)
+    print("{:7} {:,} castings on {} workers in {:.2f} s: {:,.0f}/s, {:,.0f}/s per worker".format(
+        method, count, workers, elapsed, rate, rate / workers))
+    print("        worker time {:.2f} s, {:.0%} of the run spent outside the workers".format(
+        busy, max(0.0, 1 - busy / (elapsed * workers))))
+    for check in checks(method, histogram):
+        print("        {:12} chi-square {:9.2f} on {:2} df, p = {:.4f}{}".format(
+            check.test, check.statistic, check.freedom, check.p_value,
+            "  SUSPECT" if check.p_value < SIGNIFICANCE else ""))
+    return rate
+
+
+def scaling(method, count):
+    """Throughput with 1, 2, 4 ... workers up to the number of cores."""
+    cores = os.cpu_count() or 1
+    steps = sorted(set([1 << power for power in range(cores.bit_length()) if 1 << power <= cores] + [cores]))
+    single = None
+    for workers in steps:
+        rate = print_run(method, count, workers, 1)
+        single = single or rate
+        print("        speed up {:.2f}x on {} workers, {:.0%} efficiency".format(
+            rate / single, workers, rate / single / workers))
+
+
+def option(name, default):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+        sys.exit("{} needs a value".format(name))
+    return default
+
+
+def count_arg(arg):                     # "1e9" or "1000000" as an int, None if arg is not a count
+    try:
+        return int(float(arg))
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    workers = int(option("--workers", os.cpu_count() or 1))
+    args = sys.argv[1:]
+    if "--workers" in args:
+        del args[args.index("--workers"):args.index("--workers") + 2]
+    methods = [arg for arg in args if arg in CAST_METHODS] or list(CAST_METHODS)
+    counts = [count_arg(arg) for arg in args if count_arg(arg) is not None]
+    count = counts[0] if counts else DEFAULT_COUNT
+    if [arg for arg in args if arg not in CAST_METHODS and arg != "scaling" and count_arg(arg) is None]:
+        print("usage: ichingsim.py [scaling] [method] [count] [--workers N]")
+    elif "scaling" in args:
+        for method in methods:
+            scaling(method, count)
+    else:
+        for method in methods:
+            print_run(method, count, workers)
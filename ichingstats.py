@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# Statistics over a history of castings, for checking the casting methods.
+#
+# A history is three NumPy arrays of equal length: method codes (JOURNAL_METHODS
+# positions), yang masks and moving masks, usually the records of a casting journal.
+# Everything is counted with one np.bincount pass over the whole arrays:
+#
+#   hexagram counts   - castings of each King Wen number, per method
+#   line counts       - how often each line position was 6, 7, 8 or 9, per method
+#   transitions       - 64x64 counts of primary to relating hexagram, by King Wen number
+#   chi-square checks - line values against ichingcast.line_probabilities() for Stalks and
+#                       Coins, and the hexagram and moving line for Dice, which always moves
+#                       exactly one line
+#
+#   python3 ichingstats.py report FILE       - report on a casting journal
+#   python3 ichingstats.py benchmark [count] - report on count simulated castings, timed
+#
+
+import math
+import sys
+from collections import namedtuple
+from time import perf_counter
+
+from ichingcast import CAST_METHODS, cast_batch, line_probabilities, make_generator
+from ichinghexagrams import HEXAGRAMS, HEXAGRAM_COUNT, KING_WEN, LINE_COUNT, LINE_VALUES, need_numpy
+from ichingjournal import JOURNAL_METHODS
+
+METHOD_COUNT = len(JOURNAL_METHODS)
+LINE_CODES = 4                                  # yang << 1 | moving, as LINE_VALUES
+SIGNIFICANCE = 0.001                            # p-values below this are reported as suspect
+
+History = namedtuple('History', ['method', 'yang', 'moving'])
+Stats = namedtuple('Stats', ['castings', 'hexagrams', 'lines', 'transitions'])
+ChiSquare = namedtuple('ChiSquare', ['method', 'test', 'statistic', 'freedom', 'p_value'])
+
+
+def history_from_journal(journal):
+    records = journal.records()
+    return History(records['method'], records['yang'], records['moving'])
+
+
+def simulated_history(count, seed=None):
+    """count castings shared between the CAST_METHODS, for benchmarks and checks."""
+    np = need_numpy()
+    generator = make_generator(seed)
+    parts = [cast_batch(method, count // len(CAST_METHODS), generator) for method in CAST_METHODS]
+    methods = [np.full(len(yang), JOURNAL_METHODS.index(method), dtype=np.uint8)
+               for method, (yang, moving) in zip(CAST_METHODS, parts)]
+    return History(np.concatenate(methods), np.concatenate([yang for yang, moving in parts]),
+                   np.concatenate([moving for yang, moving in parts]))
+
+
+def collect(history):
+    """Count a history in a single pass, returns Stats.
+
+    Every casting is counted by (method, yang, moving) in one np.bincount, and the
+    rest is worked out from that 4x64x64 table.  hexagrams[method, number - 1],
+    lines[method, line, yang << 1 | moving] and transitions[primary - 1, relating - 1]
+    are NumPy count arrays.
+    """
+    np = need_numpy()
+    keys = history.method.astype(np.intp) << 12
+    keys |= history.yang.astype(np.intp) << 6
+    keys |= history.moving
+    joint = np.bincount(keys, minlength=METHOD_COUNT << 12).reshape(METHOD_COUNT, HEXAGRAM_COUNT, HEXAGRAM_COUNT)
+    return stats_from_joint(joint)
+
+
+def stats_from_joint(joint):
+    """Stats from counts of castings by [method, yang, moving]."""
+    np = need_numpy()
+    numbers = np.asarray(KING_WEN, dtype=np.intp) - 1            # King Wen number - 1, by mask
+    hexagrams = np.zeros((METHOD_COUNT, HEXAGRAM_COUNT), dtype=np.int64)
+    hexagrams[:, numbers] = joint.sum(axis=2)
+    yang, moving = np.meshgrid(np.arange(HEXAGRAM_COUNT), np.arange(HEXAGRAM_COUNT), indexing='ij')
+    lines = np.empty((METHOD_COUNT, LINE_COUNT, LINE_CODES), dtype=np.int64)
+    for line in range(LINE_COUNT):
+        codes = ((yang >> line & 1) << 1 | moving >> line & 1).ravel()
+        for method in range(METHOD_COUNT):
+            lines[method, line] = np.bincount(codes, weights=joint[method].ravel(), minlength=LINE_CODES)
+    transitions = np.zeros((HEXAGRAM_COUNT, HEXAGRAM_COUNT), dtype=np.int64)
+    np.add.at(transitions, (numbers[yang], numbers[yang ^ moving]), joint.sum(axis=0))
+    return Stats(int(joint.sum()), hexagrams, lines, transitions)
+
+
+def upper_gamma(a, x):
+    """Regularized upper incomplete gamma function Q(a, x), for chi-square p-values."""
+    if x <= 0:
+        return 1.0
+    if x < a + 1:                               # Series for P(a, x), converges quickly here
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(-x + a * math.log(x) - math.lgamma(a)))
+    tiny = 1e-300                               # Continued fraction for Q(a, x), by Lentz's method
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    result = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        result *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return result * math.exp(-x + a * math.log(x) - math.lgamma(a))
+
+
+def chi_square(method, test, observed, expected):
+    np = need_numpy()
+    observed = np.asarray(observed, dtype=np.float64)
+    expected = np.asarray(expected, dtype=np.float64)
+    statistic = float(((observed - expected) ** 2 / expected).sum())
+    freedom = len(observed) - 1
+    return ChiSquare(method, test, statistic, freedom, upper_gamma(freedom / 2.0, statistic / 2.0))
+
+
+def method_checks(stats):
+    """Chi-square checks of each cast method in stats against the odds it promises."""
+    checks = []
+    for method in CAST_METHODS:
+        code = JOURNAL_METHODS.index(method)
+        castings = int(stats.hexagrams[code].sum())
+        if castings == 0:
+            continue
+        if method == "Dice":                    # Hexagrams are even chances, one line in six moves
+            checks.append(chi_square(method, "hexagram", stats.hexagrams[code],
+                                     [castings / HEXAGRAM_COUNT] * HEXAGRAM_COUNT))
+            moved = stats.lines[code, :, 1] + stats.lines[code, :, 3]
+            checks.append(chi_square(method, "moving line", moved, [castings / LINE_COUNT] * LINE_COUNT))
+            continue
+        odds = line_probabilities(method)
+        observed = stats.lines[code].sum(axis=0)                 # By line code, all six lines
+        expected = [castings * LINE_COUNT * float(odds[value]) for value in LINE_VALUES]
+        checks.append(chi_square(method, "line values", observed, expected))
+    return checks
+
+
+def report(stats):
+    """The statistics as printable lines."""
+    np = need_numpy()
+    lines = ["{:,} castings".format(stats.castings)]
+    for code, method in enumerate(JOURNAL_METHODS):
+        count = int(stats.hexagrams[code].sum())
+        if count == 0:
+            continue
+        values = stats.lines[code].sum(axis=0) / (count * LINE_COUNT)
+        lines.append("{:7} {:12,} castings, lines {}".format(method, count, "  ".join(
+            "{}: {:.4f}".format(LINE_VALUES[line_code], values[line_code]) for line_code in (1, 2, 0, 3))))
+    totals = stats.hexagrams.sum(axis=0)
+    order = np.argsort(totals, kind='stable')
+    for label, number in (("Most cast", order[-1] + 1), ("Least cast", order[0] + 1)):
+        lines.append("{:10} {:2} {:20} {:,}".format(label, number, HEXAGRAMS[number].name, int(totals[number - 1])))
+    changed = stats.transitions.sum() - np.trace(stats.transitions)
+    lines.append("{:,} castings had moving lines".format(int(changed)))
+    flat = stats.transitions.copy()
+    np.fill_diagonal(flat, 0)
+    for index in np.argsort(flat, axis=None)[::-1][:3]:
+        primary, relating = divmod(int(index), HEXAGRAM_COUNT)
+        if flat[primary, relating]:
+            lines.append("  {:2} -> {:2} {:,}".format(primary + 1, relating + 1, int(flat[primary, relating])))
+    for check in method_checks(stats):
+        lines.append("{:7} {:12} chi-square {:9.2f} on {:2} df, p = {:.4f}{}".format(
+            check.method, check.test, check.statistic, check.freedom, check.p_value,
+            "  SUSPECT" if check.p_value < SIGNIFICANCE else ""))
+    return lines
+
+
+def journal_summary(journal):           # Two LCD lines from the journal's index, no NumPy needed
+    counts = [len(numbers) for numbers in journal.by_number]
+    if not len(journal):
+        return "No castings yet", ""
+    number = counts.index(max(counts))
+    return "{} castings".format(len(journal)), "Most {} {}".format(number, HEXAGRAMS[number].name)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "report":
+        from ichingjournal import Journal
+        journal = Journal(sys.argv[2])
+        print("\n".join(report(collect(history_from_journal(journal)))))
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000000
+        history = simulated_history(count, 1)
+        start = perf_counter()
+        lines = report(collect(history))
+        elapsed = perf_counter() - start
+        print("\n".join(lines))
+        print("Report on {:,} castings took {:.0f} ms".format(len(history.yang), elapsed * 1000))
+    else:
+        print("usage: ichingstats.py report FILE | benchmark [count]")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+#
+# System information for the Settings > Display screen, read in process.
+#
+# Addresses are read the way `hostname --all-ip-addresses` finds them, without starting a
+# shell: IPv4 with the SIOCGIFADDR ioctl on each interface and IPv6 from /proc/net/if_inet6,
+# leaving out loopback and link local addresses.  They are cached, and only read again when
+# the kernel reports an address change on a netlink socket, or after ADDRESS_TTL seconds
+# where netlink is not available.  Load and temperature come from /proc and /sys and are
+# cached for STATUS_TTL seconds.
+#
+# stop_service() stops the PiFaceCAD sysinfo service, which would otherwise keep drawing on
+# the LCD, on a background thread so the display never waits for it.  It runs `service name
+# stop`, which works under both sysvinit and systemd, and only falls back to `systemctl stop`
+# where there is no service command.  A failure is printed, as the service will draw over
+# the menus.
+#
+#   python3 ichingsysinfo.py            - print the addresses and status
+#   python3 ichingsysinfo.py benchmark  - time the cached lookups against hostname -I
+#
+
+import socket
+import struct
+import sys
+import threading
+from time import monotonic, perf_counter
+
+ADDRESS_TTL = 30.0          # 30 seconds before addresses are read again without a netlink change
+STATUS_TTL = 1.0            # 1 second before load and temperature are read again
+SYSINFO_SERVICE = "pifacecadsysinfo"
+SIOCGIFADDR = 0x8915        # Linux ioctl for an interface's IPv4 address
+RTMGRP_IPV4_IFADDR = 0x10   # Netlink groups announcing address changes
+RTMGRP_IPV6_IFADDR = 0x100
+IPV6_GLOBAL_SCOPE = 0x00
+THERMAL_FILE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def ipv4_addresses():
+    import fcntl                                # Unix only, like the ioctl
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        for index, name in socket.if_nameindex():
+            try:
+                request = struct.pack('256s', name.encode()[:15])
+                address = socket.inet_ntoa(fcntl.ioctl(probe.fileno(), SIOCGIFADDR, request)[20:24])
+            except OSError:                     # Interface without an IPv4 address
+                continue
+            if not address.startswith("127."):
+                addresses.append(address)
+    return addresses
+
+
+def ipv6_addresses(path="/proc/net/if_inet6"):
+    addresses = []
+    try:
+        with open(path) as table:
+            for line in table:
+                fields = line.split()
+                if len(fields) >= 4 and int(fields[3], 16) == IPV6_GLOBAL_SCOPE:
+                    addresses.append(socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0])))
+    except OSError:                             # No IPv6 on this machine
+        pass
+    return addresses
+
+
+def open_netlink():                             # Socket told about address changes, None if there is none
+    try:
+        watch = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        watch.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        watch.setblocking(False)
+        return watch
+    except (AttributeError, OSError):
+        return None
+
+
+def read_number(path, field=0, scale=1.0):
+    try:
+        with open(path) as source:
+            return float(source.read().split()[field]) / scale
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SystemInfo(object):
+    """Cached addresses and status, read again only when they may have changed."""
+    def __init__(self, ttl=ADDRESS_TTL, clock=monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.watch = open_netlink()
+        self.cached = None                      # Addresses, until a change or the time to live runs out
+        self.expires = 0.0
+        self.status_cache = None
+        self.status_expires = 0.0
+        self.reads = 0                          # Times the addresses were actually read
+#
+    def changed(self):                          # Drain the netlink socket, True if anything came
+        changed = False
+        while self.watch is not None:
+            try:
+                if not self.watch.recv(65536):
+                    break
+                changed = True
+            except BlockingIOError:
+                break
+            except OSError:                     # Messages overflowed the buffer, so something changed
+                changed = True
+                break
+        return changed
+#
+    @property
+    def addresses(self):
+        with self.lock:
+            now = self.clock()
+            if self.changed() or self.cached is None or (self.watch is None and now >= self.expires):
+                self.cached = ipv4_addresses() + ipv6_addresses()
+                self.expires = now + self.ttl
+                self.reads += 1
+            return self.cached
+#
+    @property
+    def status(self):
+        """(one minute load, CPU temperature in C or None)."""
+        now = self.clock()
+        if self.status_cache is None or now >= self.status_expires:
+            self.status_cache = (read_number("/proc/loadavg"), read_number(THERMAL_FILE, scale=1000.0))
+            self.status_expires = now + STATUS_TTL
+        return self.status_cache
+#
+    def screen(self, width=16):
+        """Two LCD lines: the first address, then the load and temperature."""
+        addresses = self.addresses
+        load, temperature = self.status
+        topline = addresses[0] if addresses else "No network"
+        botline = "Load {:.2f}".format(load) if load is not None else "Load ?"
+        if temperature is not None:
+            botline += " {:.0f}C".format(temperature)
+        return topline[:width], botline[:width]
+#
+    def close(self):
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
+
+
+system_info = None                              # Shared by every session, made on first use
+
+
+def get_system_info():
+    global system_info
+    if system_info is None:
+        system_info = SystemInfo()
+    return system_info
+
+
+def stop_service(name=SYSINFO_SERVICE):
+    """Stop a system service on a background thread, without a shell.  Returns the thread."""
+    def run():
+        import subprocess
+        for command in (["service", name, "stop"], ["systemctl", "stop", name]):
+            try:
+                result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                        timeout=30)
+            except FileNotFoundError:           # No such command on this system, try the next
+                continue
+            except (OSError, subprocess.SubprocessError) as error:
+                print("Could not stop {}: {}".format(name, error))
+                return
+            if result.returncode != 0:
+                print("Could not stop {}: {} exited with {}: {}".format(
+                    name, " ".join(command), result.returncode, result.stderr.decode(errors='replace').strip()))
+            return
+        print("Could not stop {}: neither service nor systemctl is installed".format(name))
+    stopper = threading.Thread(target=run, name="StopService", daemon=True)
+    stopper.start()
+    return stopper
+
+
+def benchmark(count=10000):
+    import subprocess
+    start = perf_counter()
+    subprocess.check_output("hostname --all-ip-addresses", shell=True)
+    shell = perf_counter() - start
+    info = SystemInfo()
+    start = perf_counter()
+    info.addresses
+    first = perf_counter() - start
+    start = perf_counter()
+    for index in range(count):
+        info.screen()
+    cached = (perf_counter() - start) / count
+    print("hostname -I through a shell {:.2f} ms".format(shell * 1000))
+    print("first read {:.3f} ms, cached screen {:.2f} us, addresses read {} times, netlink {}".format(
+        first * 1000, cached * 1e6, info.reads, "on" if info.watch is not None else "off"))
+    info.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    elif len(sys.argv) > 1:
+        print("usage: ichingsysinfo.py [benchmark]")
+    else:
+        info = SystemInfo()
+        print(" ".join(info.addresses))
+        print("\n".join(info.screen()))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# Hexagram texts compiled into one file and read through mmap.
+#
+# The texts are written in hexagram_text.txt and compiled into hexagram_text.dat:
+#
+#   header   TEXT_HEADER: TEXT_MAGIC, the hexagram slots (65, slot 0 unused) and fields
+#   table    one ENTRY (offset, length) per slot and field, slot by slot in TEXT_FIELDS order
+#   strings  UTF-8 text, each distinct string stored once
+#
+# HexagramText maps the file and decodes a field only when it is asked for, so no text is
+# held as Python strings until the display needs it, and translations are just more files.
+#
+#   python3 ichingtext.py build [source] [output]  - compile the texts
+#   python3 ichingtext.py show number [file]       - print a hexagram's texts
+#   python3 ichingtext.py benchmark [languages]    - memory and load time against dicts
+#
+
+import marshal
+import mmap
+import os
+import sys
+import tracemalloc
+from struct import Struct
+from time import perf_counter
+
+from ichinghexagrams import HEXAGRAM_COUNT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEXT_SOURCE = os.path.join(HERE, "hexagram_text.txt")
+TEXT_FILE = os.path.join(HERE, "hexagram_text.dat")
+TEXT_MAGIC = b"ICT1"
+TEXT_HEADER = Struct("<4sHH")                   # Magic, hexagram slots, fields per slot
+ENTRY = Struct("<II")                           # Offset into the strings, length in bytes
+TEXT_FIELDS = ('name', 'meaning', 'judgement', 'line_1', 'line_2', 'line_3', 'line_4', 'line_5',
+               'line_6', 'static')
+FIELD_INDEX = dict((field, index) for index, field in enumerate(TEXT_FIELDS))
+SLOTS = HEXAGRAM_COUNT + 1
+
+
+def parse_source(path=TEXT_SOURCE):
+    """Read a text source, returns {number: {field: text}}."""
+    hexagrams = {}
+    fields = None
+    with open(path, encoding='utf-8') as source:
+        for number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                fields = hexagrams.setdefault(int(line[1:-1]), {})
+                continue
+            field, separator, text = line.partition(":")
+            if fields is None or not separator or field.strip() not in FIELD_INDEX:
+                raise ValueError("{} line {}: expected [number] or field: text".format(path, number))
+            fields[field.strip()] = text.strip()
+    return hexagrams
+
+
+def compile_text(hexagrams):
+    """The file contents for {number: {field: text}}."""
+    strings = bytearray()
+    offsets = {}                                # Each distinct text to its offset
+    table = bytearray()
+    for number in range(SLOTS):
+        fields = hexagrams.get(number, {})
+        for field in TEXT_FIELDS:
+            encoded = fields.get(field, "").encode('utf-8')
+            if encoded not in offsets:
+                offsets[encoded] = len(strings)
+                strings += encoded
+            table += ENTRY.pack(offsets[encoded], len(encoded))
+    return TEXT_HEADER.pack(TEXT_MAGIC, SLOTS, len(TEXT_FIELDS)) + bytes(table) + bytes(strings)
+
+
+def build(source=TEXT_SOURCE, path=TEXT_FILE):
+    data = compile_text(parse_source(source))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+class HexagramText(object):
+    """Texts of a compiled file, decoded one field at a time."""
+    def __init__(self, path=TEXT_FILE):
+        with open(path, "rb") as source:
+            self.data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slots, fields = TEXT_HEADER.unpack_from(self.data) if len(self.data) >= TEXT_HEADER.size else (b"", 0, 0)
+        if magic != TEXT_MAGIC or slots != SLOTS or fields != len(TEXT_FIELDS):
+            self.data.close()
+            raise ValueError("{} is not a hexagram text file".format(path))
+        self.strings = TEXT_HEADER.size + SLOTS * len(TEXT_FIELDS) * ENTRY.size
+        if len(self.data) < self.strings:
+            self.data.close()
+            raise ValueError("{} is truncated".format(path))
+#
+    def text(self, number, field):
+        """The field of hexagram number, "" if it has none."""
+        offset, length = ENTRY.unpack_from(
+            self.data, TEXT_HEADER.size + (number * len(TEXT_FIELDS) + FIELD_INDEX[field]) * ENTRY.size)
+        start = self.strings + offset
+        return self.data[start:start + length].decode('utf-8')
+#
+    def close(self):
+        self.data.close()
+
+
+hexagram_text = None                            # Shared by every session, opened on first use
+
+
+def get_hexagram_text():
+    global hexagram_text
+    if hexagram_text is None:
+        hexagram_text = HexagramText()
+    return hexagram_text
+
+
+def synthetic_texts(languages):                 # Every field of all 64 hexagrams, once per language
+    return [dict(((number, field), "{} {} text of hexagram {} in language {}, long enough to wrap".format(
+        field, number, number, language)) for number in range(1, SLOTS) for field in TEXT_FIELDS)
+        for language in range(languages)]
+
+
+def benchmark(languages=4):
+    texts = synthetic_texts(languages)
+    literal = repr([[dict((field, text[number, field]) for field in TEXT_FIELDS)
+                     for number in range(1, SLOTS)] for text in texts])
+    compiled = marshal.dumps(compile(literal, "literal", "eval"))
+    tracemalloc.start()
+    start = perf_counter()
+    dicts = eval(marshal.loads(compiled))       # As importing a module of dict literals from its .pyc
+    dict_time = perf_counter() - start
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    paths = []
+    for language, text in enumerate(texts):
+        paths.append("{}.bench{}".format(TEXT_FILE, language))
+        hexagrams = {}
+        for (number, field), value in text.items():
+            hexagrams.setdefault(number, {})[field] = value
+        with open(paths[-1], "wb") as output:
+            output.write(compile_text(hexagrams))
+    tracemalloc.start()
+    start = perf_counter()
+    stores = [HexagramText(path) for path in paths]
+    store_time = perf_counter() - start
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    count = 100000
+    start = perf_counter()
+    for index in range(count):
+        stores[0].text(54, 'line_4')
+    lookup = (perf_counter() - start) / count
+    print("{} languages x 64 hexagrams x {} fields".format(languages, len(TEXT_FIELDS)))
+    print("dicts   {:8.2f} ms to load {:10,} bytes of Python objects".format(dict_time * 1000, dict_bytes))
+    print("mmap    {:8.2f} ms to open {:10,} bytes of Python objects, {:,} bytes of files on disk".format(
+        store_time * 1000, store_bytes, sum(os.path.getsize(path) for path in paths)))
+    print("one field decoded in {:.2f} us".format(lookup * 1e6))
+    del dicts
+    for store, path in zip(stores, paths):
+        store.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        source = sys.argv[2] if len(sys.argv) > 2 else TEXT_SOURCE
+        path = sys.argv[3] if len(sys.argv) > 3 else TEXT_FILE
+        build(source, path)
+        print("Wrote " + path)
+    elif len(sys.argv) > 2 and sys.argv[1] == "show":
+        texts = HexagramText(sys.argv[3] if len(sys.argv) > 3 else TEXT_FILE)
+        for field in TEXT_FIELDS:
+            print("{:9} {}".format(field, texts.text(int(sys.argv[2]), field)))
+    elif len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    else:
+        print("usage: ichingtext.py build [source] [output] | show number [file] | benchmark [languages]")
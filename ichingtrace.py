@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+# Call tracing for the I Ching Hexagrams PiFaceCAD program.
+#
+# Set ICHING_TRACE to a file name to count and time the switch and remote callbacks, the
+# menu and hexagram drawing, frame renders and every call on the LCD.  Each traced name
+# gets a latency histogram, written to the file as Prometheus text (for the node_exporter
+# textfile collector) or, if the name ends in .json, as JSON.  The file is rewritten every
+# WRITE_INTERVAL seconds by the main loop and when the program stops.
+#
+# Set ICHING_TRACE_RING to N as well to keep the last N calls and write them to the file
+# name plus .ring as a Chrome trace, which chrome://tracing and Perfetto can show.
+#
+# Tracing is decided when this module is imported.  With ICHING_TRACE unset traced() and
+# instrument_lcd() hand back what they are given, so nothing is wrapped and it costs nothing.
+#
+#   python3 ichingtrace.py overhead     - time a call with and without a tracer
+#
+
+import atexit
+import json
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter
+
+TRACE_FILE = os.environ.get("ICHING_TRACE", "")
+RING_SIZE = int(os.environ.get("ICHING_TRACE_RING", "0") or 0)
+WRITE_INTERVAL = 10         # 10 seconds between rewrites of the trace file
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)    # Histogram upper bounds, in seconds
+LCD_CALLS = ('write', 'write_custom_bitmap', 'store_custom_bitmap', 'set_cursor', 'clear', 'home',
+             'move_left', 'move_right', 'backlight_on', 'backlight_off', 'display_on', 'display_off',
+             'blink_on', 'blink_off', 'cursor_on', 'cursor_off')
+
+
+class Histogram(object):
+    """Call count, total and longest time, and counts by BUCKETS (the last is +Inf)."""
+    __slots__ = ('counts', 'count', 'total', 'peak')
+#
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+#
+    def add(self, elapsed):
+        self.counts[bisect_left(BUCKETS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        self.peak = max(self.peak, elapsed)
+#
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Tracer(object):
+    """Latency histograms by name, and a ring of the most recent calls."""
+    def __init__(self, path, ring_size=0, clock=perf_counter):
+        self.path = path
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()            # Callbacks, the main loop and the LCD writer all record
+        self.histograms = {}
+        self.ring = deque(maxlen=ring_size) if ring_size else None
+#
+    def record(self, name, start, elapsed):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(elapsed)
+            if self.ring is not None:
+                self.ring.append((name, start, elapsed, threading.get_ident()))
+#
+    def timed(self, name, function):
+        """function, counted and timed under name."""
+        clock = self.clock
+        record = self.record
+        def traced_call(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, start, clock() - start)
+        traced_call.__name__ = getattr(function, '__name__', name)
+        traced_call.__doc__ = function.__doc__
+        return traced_call
+#
+    def instrument_lcd(self, lcd):
+        for call in LCD_CALLS:
+            if hasattr(lcd, call):
+                setattr(lcd, call, self.timed("lcd." + call, getattr(lcd, call)))
+#
+    def prometheus(self):
+        lines = ["# HELP iching_call_seconds Time spent in traced I Ching calls.",
+                 "# TYPE iching_call_seconds histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                bounds = [repr(bound) for bound in BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulative()):
+                    lines.append('iching_call_seconds_bucket{{name="{}",le="{}"}} {}'.format(name, bound, count))
+                lines.append('iching_call_seconds_sum{{name="{}"}} {!r}'.format(name, histogram.total))
+                lines.append('iching_call_seconds_count{{name="{}"}} {}'.format(name, histogram.count))
+        return "\n".join(lines) + "\n"
+#
+    def summary(self):
+        with self.lock:
+            return dict((name, {
+                'count': histogram.count,
+                'total_seconds': histogram.total,
+                'max_seconds': histogram.peak,
+                'buckets': dict(zip([repr(bound) for bound in BUCKETS] + ["+Inf"], histogram.counts)),
+            }) for name, histogram in self.histograms.items())
+#
+    def chrome_trace(self):
+        with self.lock:
+            calls = list(self.ring or ())
+        return {'traceEvents': [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                                 'ts': (start - self.started) * 1e6, 'dur': elapsed * 1e6}
+                                for name, start, elapsed, thread in calls]}
+#
+    def write(self):
+        """Rewrite the trace file, and the ring file if there is one, atomically."""
+        if self.path.endswith(".json"):
+            replace_file(self.path, json.dumps(self.summary(), indent=2, sort_keys=True))
+        else:
+            replace_file(self.path, self.prometheus())
+        if self.ring is not None:
+            replace_file(self.path + ".ring", json.dumps(self.chrome_trace()))
+#
+    def write_frames(self):                     # Scheduler animation that rewrites the file now and then
+        while True:
+            yield WRITE_INTERVAL
+            self.write()
+
+
+def replace_file(path, text):                   # Readers see the old file or the new one, never half
+    temporary = path + ".tmp"
+    with open(temporary, "w") as output:
+        output.write(text)
+    os.replace(temporary, path)
+
+
+tracer = Tracer(TRACE_FILE, RING_SIZE) if TRACE_FILE else None
+if tracer is not None:
+    atexit.register(tracer.write)
+
+
+def traced(name):
+    """Decorator timing a function under name, it leaves the function alone when not tracing."""
+    def decorate(function):
+        return function if tracer is None else tracer.timed(name, function)
+    return decorate
+
+
+def trace_callback(name, callback):
+    return callback if tracer is None else tracer.timed(name, callback)
+
+
+def instrument_lcd(lcd):
+    if tracer is not None:
+        tracer.instrument_lcd(lcd)
+    return lcd
+
+
+def overhead(count=1000000):
+    def call():
+        pass
+    timed = Tracer(os.devnull, RING_SIZE or 1000).timed("call", call)
+    for label, function in (("untraced", trace_callback("call", call)), ("traced", timed)):
+        start = perf_counter()
+        for index in range(count):
+            function()
+        print("{:9} {:.3f} us per call".format(label, (perf_counter() - start) / count * 1e6))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "overhead":
+        overhead()
+    else:
+        print("usage: ichingtrace.py overhead")
@@ -0,0 +1,28 @@
+from ichingbackend import SimulatedCAD, SimulatedIRListener
+
+
+def listen(cad, codes):
+    listener = SimulatedIRListener(prog="test", chip=cad)
+    listener.register("1", lambda event: codes.append(event.ir_code))
+    listener.activate()
+    return listener
+
+
+def test_remote_reaches_only_its_own_board():
+    first, second = SimulatedCAD(), SimulatedCAD()
+    first_codes, second_codes = [], []
+    listen(first, first_codes)
+    listen(second, second_codes)
+    first.press_ir(1)
+    assert first_codes == ["1"]
+    assert second_codes == []
+
+
+def test_deactivated_listener_is_let_go():
+    cad = SimulatedCAD()
+    codes = []
+    listener = listen(cad, codes)
+    listener.deactivate()
+    assert cad.ir_listeners == []
+    cad.press_ir(1)
+    assert codes == []
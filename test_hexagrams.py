@@ -0,0 +1,24 @@
+import pytest
+
+import ichinghexagrams
+from ichinghexagrams import KNOWN_CASTINGS, Casting
+
+
+def test_validate_finds_no_problems():
+    assert ichinghexagrams.validate() == []
+
+
+@pytest.mark.parametrize("values, number, relating_number", KNOWN_CASTINGS)
+def test_known_casting(values, number, relating_number):
+    casting = Casting.from_values(values)
+    assert casting.primary.number == number
+    assert casting.relating.number == relating_number
+    assert casting.transformed().primary.number == relating_number
+
+
+def test_validate_catches_a_swapped_table(monkeypatch):
+    king_wen = list(ichinghexagrams.KING_WEN)
+    gou, guai = ichinghexagrams.HEXAGRAMS[44].mask, ichinghexagrams.HEXAGRAMS[43].mask
+    king_wen[gou], king_wen[guai] = king_wen[guai], king_wen[gou]
+    monkeypatch.setattr(ichinghexagrams, "KING_WEN", king_wen)
+    assert any("Casting" in problem for problem in ichinghexagrams.validate())
@@ -0,0 +1,27 @@
+from ichingcast import Caster
+from ichingjournal import Journal
+
+
+def test_append_leaves_the_fsync_to_a_timer(tmp_path, timers):
+    journal = Journal(str(tmp_path / "iching.journal"), call_later=timers.call_later)
+    caster = Caster(1)
+    for index in range(3):
+        journal.append(caster.cast("Coins"), "Coins")
+    assert journal.unsynced == 3                # Nothing fsynced while casting
+    assert len(timers.calls) == 1               # One timer for the lot
+    timers.expire()
+    assert journal.unsynced == 0
+    journal.close()
+
+
+def test_close_syncs_and_reopens_with_every_record(tmp_path, timers):
+    path = str(tmp_path / "iching.journal")
+    journal = Journal(path, call_later=timers.call_later)
+    casting = Caster(1).cast("Dice")
+    journal.append(casting, "Dice")
+    journal.close()
+    assert timers.calls[0].cancelled
+    journal = Journal(path)
+    assert len(journal) == 1
+    assert journal.record(0).casting == casting
+    journal.close()
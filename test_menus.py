@@ -0,0 +1,49 @@
+import os
+
+os.environ["ICHING_BACKEND"] = "simulator"
+
+from itertools import count                     # noqa: E402
+
+import ichingmenus                              # noqa: E402
+from ichingbench import press, start_session   # noqa: E402
+
+
+def test_back_at_top_level_leaves_menus_working():
+    session = start_session()
+    press(session, [4])                         # Back at Level 1
+    assert session.display_lcd.topline == " Button Disabled."
+    assert not session.menus.paused
+    press(session, [7])                         # Next
+    assert session.menus.current_menu_index == 1
+    assert session.display_lcd.topline.rstrip() == ichingmenus.MAIN_MENU[1].topline
+
+
+def test_press_during_marquee_is_handled_on_the_main_loop():
+    session = start_session()
+    press(session, [5, 5])                      # Cast with Stalks
+    session.menus.start_marquee(["A hexagram text long enough to scroll across the display"])
+    marquee = session.menus.marquee
+    assert marquee is not None and not marquee.done
+    session.cad.press(4)                        # Back, on the listener
+    assert not marquee.cancelled                # Only the main loop stops the marquee
+    ichingmenus.run_pending(session)
+    assert marquee.cancelled
+    assert session.menus.menu_level == 1
+
+
+def test_quick_switch_taps_move_one_item_each():
+    session = start_session()
+    session.input_filter.clock = count(0.0, 0.15).__next__     # Taps 150 ms apart
+    press(session, [7] * 12)                    # Next, three times round the four items
+    assert session.menus.current_menu_index == 0
+    assert session.input_filter.counts["switch 7"]['repeated'] == 0
+
+
+def test_held_remote_button_is_one_press():
+    session = start_session()
+    session.input_filter.clock = count(0.0, 0.1).__next__      # LIRC repeat codes
+    for repeat in range(5):
+        session.cad.press_ir(2)
+        ichingmenus.run_pending(session)
+    counts = session.input_filter.counts["ir 2"]
+    assert (counts['delivered'], counts['dropped']) == (1, 4)
@@ -0,0 +1,82 @@
+import json
+from time import sleep
+
+import pytest
+
+from ichingsettings import Settings
+
+
+def read(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def test_change_is_written_when_closed_straight_after_the_delay(tmp_path, timers):
+    path = str(tmp_path / "iching.settings")
+    settings = Settings(path, timers.call_later)
+    settings.set('cast_method', "Coins")
+    timers.expire()                             # The writer thread is asked to write
+    settings.close()                            # and must finish before close returns
+    assert read(path)['cast_method'] == "Coins"
+    assert Settings(path)['cast_method'] == "Coins"
+
+
+def test_change_still_waiting_is_written_by_close(tmp_path, timers):
+    path = str(tmp_path / "iching.settings")
+    settings = Settings(path, timers.call_later)
+    settings.set('backlight', "1 min")
+    settings.close()
+    assert read(path)['backlight'] == "1 min"
+
+
+def test_runs_of_changes_are_written_by_one_thread(tmp_path, timers):
+    path = str(tmp_path / "iching.settings")
+    settings = Settings(path, timers.call_later)
+    for index in range(10):
+        settings.cycle('scroll_speed')
+    assert len([timer for timer in timers.calls if not timer.cancelled]) == 1
+    timers.expire()
+    writer = settings.writer
+    settings.set('navigation', "Swapped")
+    timers.expire()
+    assert settings.writer is writer
+    settings.close()
+    assert settings.writes <= 2                 # Saves close together may be one write
+    assert read(path)['navigation'] == "Swapped"
+
+
+def test_invalid_values_fall_back_to_defaults(tmp_path, timers):
+    path = tmp_path / "iching.settings"
+    path.write_text('{"backlight": "2 min", "scroll_speed": "Fast", "colour": "red"}')
+    settings = Settings(str(path))
+    assert settings['backlight'] == "Never"
+    assert settings['scroll_speed'] == "Fast"
+    assert len(settings.problems) == 2
+    with pytest.raises(ValueError):
+        settings.set('backlight', "2 min")
+
+
+def test_failed_write_is_reported_and_tried_again(tmp_path, timers, capsys):
+    folder = tmp_path / "missing"
+    path = str(folder / "iching.settings")
+    settings = Settings(path, timers.call_later)
+    settings.set('cast_method', "Coins")
+    timers.expire()                             # The write fails, and the writer keeps going
+    while settings.failures < 1:
+        sleep(0.01)
+    assert settings.writer.is_alive()
+    assert settings.unsaved
+    folder.mkdir()
+    settings.close()                            # Writes what the failure left unsaved
+    assert read(path)['cast_method'] == "Coins"
+    assert not settings.unsaved
+    assert "Could not write the settings" in capsys.readouterr().out
+
+
+def test_close_reports_a_failed_write_without_raising(tmp_path, timers, capsys):
+    path = str(tmp_path / "missing" / "iching.settings")
+    settings = Settings(path, timers.call_later)
+    settings.set('backlight', "30 s")
+    settings.close()
+    assert settings.unsaved and settings.failures == 1
+    assert path in capsys.readouterr().out